@@ -0,0 +1,383 @@
+''' Many boards stepped in lockstep with NumPy (needs numpy, the rest of the game does not)
+
+    a BatchEngine holds K boards of the same size with P snakes each, in
+    arrays: occupancy grids (K, cells) with the values of board.OccupancyGrid,
+    ring-buffer bodies (K, P, ring) of cell numbers y * row + x, head
+    pointers, lengths, pending growth, directions, scores and targets (K,).
+    a body never holds more cells than the board has outside the walls, so
+    that is the ring size: 4 * K * P * ring bytes, about 6 MB for 1024
+    boards of 2 snakes on 40 x 20.
+    the rules are the ones of engine.Engine.step, which check_parity runs
+    side by side with this one. a board is done at its first death, as a
+    two player match.
+
+    python batch_engine.py --boards 4096 --ticks 1000   benchmark
+    python batch_engine.py --parity                     compare with engine.Engine
+'''
+
+import argparse
+import collections
+import random as rd
+import time
+import numpy as np
+from board import OccupancyGrid
+from coord import Coord
+from engine import Engine, Event, INITIAL_SNAKE_LENGTH, SCORE_PER_TARGET, TURNS
+
+EMPTY = OccupancyGrid.EMPTY
+WALL = OccupancyGrid.WALL
+
+DIRECTION_DX = np.array([dx for dx, _ in Coord.DIRECTIONS_MOVES], dtype=np.int64)
+DIRECTION_DY = np.array([dy for _, dy in Coord.DIRECTIONS_MOVES], dtype=np.int64)
+INITIAL_DIRECTION = Coord.DIRECTIONS.index('right')
+
+
+class BatchEngine:
+
+    def __init__(self, boards, snakes, width, height, walls=None, target_space=None, seed=None,
+                 score_per_target=SCORE_PER_TARGET):
+        '''same board arguments as engine.Engine, boards start empty, see reset or from_engines
+            raises ValueError if the snakes do not fit in a grid cell
+        '''
+        if not 0 < snakes <= OccupancyGrid.MAX_SLOTS:
+            raise ValueError(f"snakes must be in [1, {OccupancyGrid.MAX_SLOTS}]")
+
+        self.boards = boards
+        self.snake_count = snakes
+        self.width = width
+        self.height = height
+        self.row = width + 1
+        self.cell_count = self.row * (height + 1)
+        self.score_per_target = score_per_target
+        self.rng = np.random.default_rng(seed)
+
+        left, top, right, bottom = walls if walls is not None else (0, 0, width, height)
+        template = OccupancyGrid(width, height)
+        template.mark_walls(left, top, right, bottom)
+        self.empty_grid = np.frombuffer(bytes(template.cells), dtype=np.uint8)
+        self.ring_size = int(np.count_nonzero(self.empty_grid != WALL))     # longest possible body
+
+        if target_space is None:
+            target_space = ((left + 1, right - 1), (top + 1, bottom - 1))
+        (x1, x2), (y1, y2) = target_space
+        xs = np.arange(self.cell_count) % self.row
+        ys = np.arange(self.cell_count) // self.row
+        self.target_space = (xs >= x1) & (xs <= x2) & (ys >= y1) & (ys <= y2)
+
+        k, p = boards, snakes
+        self.grid = np.tile(self.empty_grid, (k, 1))
+        self.bodies = np.zeros((k, p, self.ring_size), dtype=np.int32)      # ring buffers
+        self.head_ptr = np.zeros((k, p), dtype=np.int64)    # slot of the head in the ring
+        self.lengths = np.zeros((k, p), dtype=np.int64)
+        self.pending_growth = np.zeros((k, p), dtype=np.int64)
+        self.directions = np.full((k, p), INITIAL_DIRECTION, dtype=np.int64)
+        self.scores = np.zeros((k, p), dtype=np.int64)
+        self.grew = np.zeros((k, p), dtype=bool)
+        self.targets = np.full(k, -1, dtype=np.int64)      # cell number, -1 for none
+        self.done = np.zeros(k, dtype=bool)                 # a snake crashed or the board is full
+        self.ticks = np.zeros(k, dtype=np.int64)
+
+    def heads(self):
+        '''(K, P) cell numbers of the heads'''
+        return np.take_along_axis(self.bodies, self.head_ptr[:, :, None], axis=2)[:, :, 0]
+
+    def set_snake(self, board, slot, coords, direction='right'):
+        '''coords head first'''
+        cells = [c.index(self.row) for c in coords]
+        n = len(cells)
+        # the head at ring slot n - 1, the tail at 0
+        self.bodies[board, slot, :n] = cells[::-1]
+        self.head_ptr[board, slot] = n - 1
+        self.lengths[board, slot] = n
+        self.pending_growth[board, slot] = 0
+        self.directions[board, slot] = Coord.DIRECTIONS.index(direction)
+        self.grid[board, cells] = slot + 1
+
+    def reset(self, mask=None, length=INITIAL_SNAKE_LENGTH, margin=3):
+        '''new games on the boards in mask (default all): snakes facing right on different rows, like Engine.spawn_snakes'''
+        boards = np.arange(self.boards) if mask is None else np.flatnonzero(mask)
+        if len(boards) == 0:
+            return
+
+        self.grid[boards] = self.empty_grid
+        self.scores[boards] = 0
+        self.grew[boards] = False
+        self.done[boards] = False
+        self.ticks[boards] = 0
+
+        # distinct rows per board, heads at random x with the body to the left
+        rows = np.arange(margin, self.height - margin + 1)
+        picks = np.argsort(self.rng.random((len(boards), len(rows))), axis=1)[:, :self.snake_count]
+        hy = rows[picks]
+        hx = self.rng.integers(length + margin, self.width - margin - length + 1, size=(len(boards), self.snake_count))
+
+        for i, board in enumerate(boards):
+            for slot in range(self.snake_count):
+                body = [Coord(hx[i, slot] - j, hy[i, slot]) for j in range(length)]
+                self.set_snake(board, slot, body)
+
+        self.relocate_targets(boards)
+
+    def relocate_targets(self, boards):
+        '''a uniformly random free cell of the target space for each board
+            will return the mask of the boards that had no free cell, their target is -1
+        '''
+        free = (self.grid[boards] == EMPTY) & self.target_space
+        counts = free.sum(axis=1)
+        picks = (self.rng.random(len(boards)) * counts).astype(np.int64)
+
+        # the pick-th free cell: first cell where the running count passes pick
+        cells = np.argmax(np.cumsum(free, axis=1) > picks[:, None], axis=1)
+        full = counts == 0
+        self.targets[boards] = np.where(full, -1, cells)
+        return full
+
+    def step(self, inputs=None):
+        '''plays one tick on every board that is not done
+            inputs: (K, P) direction indexes in Coord.DIRECTIONS, -1 to keep going
+            will return (ate, crashed, head_on, board_full): (K, P) masks and a (K,) mask
+        '''
+        k, p = self.boards, self.snake_count
+        active = ~self.done
+        ate = np.zeros((k, p), dtype=bool)
+        crashed = np.zeros((k, p), dtype=bool)
+        head_on = np.zeros((k, p), dtype=bool)
+        board_full = np.zeros(k, dtype=bool)
+
+        self.grew[active] = False
+        if inputs is not None:
+            turn = (inputs >= 0) & active[:, None]
+            self.directions[turn] = inputs[turn]
+
+        # a snake on the target eats it, its tail stays on this move
+        has_target = active & (self.targets >= 0)
+        owner = np.zeros(k, dtype=np.int64)
+        owner[has_target] = self.grid[has_target, self.targets[has_target]]
+        eating = has_target & (owner != EMPTY) & (owner != WALL)
+        eaters = np.flatnonzero(eating)
+        if len(eaters):
+            slots = owner[eaters] - 1
+            self.pending_growth[eaters, slots] += 1
+            self.grew[eaters, slots] = True
+            self.scores[eaters, slots] += self.score_per_target
+            ate[eaters, slots] = True
+            board_full[eaters] = self.relocate_targets(eaters)
+
+        # new heads, cells outside the grid count as walls
+        heads = self.heads()
+        x = heads % self.row + DIRECTION_DX[self.directions]
+        y = heads // self.row + DIRECTION_DY[self.directions]
+        inside = (x >= 0) & (x <= self.width) & (y >= 0) & (y <= self.height)
+        new_heads = np.where(inside, y * self.row + x, 0)
+
+        # tails go first: a head may take a cell left by a tail on the same tick
+        moving = np.broadcast_to(active[:, None], (k, p))
+        growing = moving & (self.pending_growth > 0)
+        popping = moving & ~growing
+        tail_ptr = (self.head_ptr - self.lengths + 1) % self.ring_size
+        tails = np.take_along_axis(self.bodies, tail_ptr[:, :, None], axis=2)[:, :, 0]
+
+        pb, ps = np.nonzero(popping)
+        tail_cells = tails[pb, ps]
+        held = self.grid[pb, tail_cells] == ps + 1
+        self.grid[pb[held], tail_cells[held]] = EMPTY
+
+        self.pending_growth[growing] -= 1
+        self.lengths[growing] += 1
+
+        self.head_ptr[moving] = (self.head_ptr[moving] + 1) % self.ring_size
+        mb, ms = np.nonzero(moving)
+        self.bodies[mb, ms, self.head_ptr[mb, ms]] = new_heads[mb, ms]
+
+        # heads in slot order, as Engine.step does: a head that meets an earlier one
+        # is a head-on, a crashed head does not take the cell
+        for slot in range(p):
+            met = np.zeros(k, dtype=bool)
+            for other in range(slot):
+                same = active & (x[:, other] == x[:, slot]) & (y[:, other] == y[:, slot])
+                head_on[same, slot] = True
+                head_on[same, other] = True
+                met |= same
+
+            cell = new_heads[:, slot]
+            values = np.where(inside[:, slot], self.grid[np.arange(k), cell], WALL)
+            crashed[:, slot] = active & ~met & (values != EMPTY)
+            occupy = active & ~met & (values == EMPTY)
+            self.grid[occupy, cell[occupy]] = slot + 1
+
+        # the dead leave the board, as Engine.kill does: the cells of their bodies they still hold
+        db, ds = np.nonzero(crashed | head_on)
+        if len(db):
+            lengths = self.lengths[db, ds]
+            rb, rs = np.repeat(db, lengths), np.repeat(ds, lengths)
+            back = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            cells = self.bodies[rb, rs, (self.head_ptr[rb, rs] - back) % self.ring_size]
+            held = self.grid[rb, cells] == rs + 1
+            self.grid[rb[held], cells[held]] = EMPTY
+
+        self.ticks[active] += 1
+        self.done |= crashed.any(axis=1) | head_on.any(axis=1) | board_full
+        return ate, crashed, head_on, board_full
+
+    @staticmethod
+    def from_engines(engines, walls=None, target_space=None, seed=None):
+        '''a batch with the state of engine.Engine boards of the same size and snake count
+            walls, target_space: the ones the engines were made with
+        '''
+        first = engines[0]
+        batch = BatchEngine(len(engines), len(first.snakes), first.width, first.height, walls, target_space,
+                            seed, first.score_per_target)
+
+        for board, engine in enumerate(engines):
+            batch.grid[board] = np.frombuffer(bytes(engine.grid.cells), dtype=np.uint8)
+            for snake in engine.snakes:
+                batch.set_snake(board, snake.slot, list(snake.body), snake.direction)
+                batch.pending_growth[board, snake.slot] = snake.body.pending_growth
+                batch.scores[board, snake.slot] = snake.score
+            batch.targets[board] = engine.target.index(batch.row) if engine.target is not None else -1
+
+        return batch
+
+
+def hamiltonian_cycle(width, height):
+    '''will return the Coords inside the default walls in an order that visits each once and loops
+        right along the odd rows, left along the even ones, up the first column
+        height - 1 must be even
+    '''
+    cycle = [Coord(1, 1)]
+    for y in range(1, height):
+        xs = range(2, width) if y % 2 == 1 else range(width - 1, 1, -1)
+        cycle.extend(Coord(x, y) for x in xs)
+    cycle.extend(Coord(1, y) for y in range(height - 1, 1, -1))
+    return cycle
+
+
+def direction_between(a, b):
+    return Coord.DIRECTIONS[Coord.DIRECTIONS_MOVES.index((b.x - a.x, b.y - a.y))]
+
+
+def check_parity(boards=64, ticks=400, width=40, height=20, snakes=2, seed=0, cycle=False):
+    '''steps engine.Engine boards and a BatchEngine with the same inputs
+        targets are random in both, so the scalar target is copied over after
+        every meal; everything else must match tick for tick
+        cycle: the snakes follow hamiltonian_cycle instead of turning at random,
+        long games that wrap the body rings, end on a full board or when one
+        snake runs into another that just grew
+        will return (mismatch descriptions, Counter of ticks, meals, ring wraps and full boards)
+    '''
+    rng = rd.Random(seed)
+    route = hamiltonian_cycle(width, height) if cycle else None
+    engines = []
+    for i in range(boards):
+        engine = Engine(width, height, rng=rd.Random(seed * boards + i))
+        if cycle:
+            # evenly spread along the cycle, facing along it
+            for slot in range(snakes):
+                head = (i + slot * len(route) // snakes) % len(route)
+                body = [route[head - j] for j in range(INITIAL_SNAKE_LENGTH)]
+                engine.add_snake(slot, body, direction_between(body[1], body[0]))
+        else:
+            engine.spawn_snakes(snakes)
+        engine.relocate_target()
+        engines.append(engine)
+
+    batch = BatchEngine.from_engines(engines, seed=seed)
+    done = [False] * boards
+    mismatches = []
+    coverage = collections.Counter()
+
+    for tick in range(ticks):
+        inputs = np.full((boards, snakes), -1, dtype=np.int64)
+        scalar_events = []
+        for board, engine in enumerate(engines):
+            if done[board]:
+                scalar_events.append(set())
+                continue
+
+            if cycle:
+                turns = {s.slot: direction_between(s.head(), route[(route.index(s.head()) + 1) % len(route)])
+                         for s in engine.snakes if s.alive}
+            else:
+                turns = {s.slot: rng.choice(TURNS[s.direction]) for s in engine.snakes if rng.random() < 0.3}
+            for slot, direction in turns.items():
+                inputs[board, slot] = Coord.DIRECTIONS.index(direction)
+            scalar_events.append(set(engine.step(turns)))
+
+        head_ptr = batch.head_ptr.copy()
+        ate, crashed, head_on, board_full = batch.step(inputs)
+        coverage['ticks'] += boards - sum(done)
+        coverage['meals'] += int(ate.sum())
+        coverage['ring wraps'] += int(np.count_nonzero(batch.head_ptr < head_ptr))
+        coverage['full boards'] += int(board_full.sum())
+
+        for board, engine in enumerate(engines):
+            if done[board]:
+                continue
+
+            events = {(Event.ATE, s) for s in np.flatnonzero(ate[board])}
+            events |= {(Event.CRASHED, s) for s in np.flatnonzero(crashed[board])}
+            events |= {(Event.HEAD_ON, s) for s in np.flatnonzero(head_on[board])}
+            if board_full[board]:
+                events.add((Event.BOARD_FULL, None))
+
+            if events != scalar_events[board]:
+                mismatches.append(f"tick {tick} board {board}: events {events} != {scalar_events[board]}")
+            if bytes(batch.grid[board]) != bytes(engine.grid.cells):
+                mismatches.append(f"tick {tick} board {board}: grids differ")
+            for snake in engine.snakes:
+                if batch.heads()[board, snake.slot] != snake.head().index(batch.row) \
+                        or batch.lengths[board, snake.slot] != len(snake.body) \
+                        or batch.scores[board, snake.slot] != snake.score:
+                    mismatches.append(f"tick {tick} board {board}: snake {snake.slot} differs")
+
+            if ate[board].any():
+                batch.targets[board] = engine.target.index(batch.row) if engine.target is not None else -1
+
+            done[board] = bool(batch.done[board])
+
+        if all(done):
+            break
+
+    return mismatches, coverage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NumPy batch engine: benchmark, or parity with engine.Engine")
+    parser.add_argument('--boards', type=int, default=1024)
+    parser.add_argument('--snakes', type=int, default=2)
+    parser.add_argument('--ticks', type=int, default=1000)
+    parser.add_argument('--width', type=int, default=120)
+    parser.add_argument('--height', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--parity', action='store_true', help="compare with engine.Engine instead")
+    args = parser.parse_args()
+
+    if args.parity:
+        # short games with random turns, then long ones along a cycle of a small board
+        runs = [check_parity(snakes=args.snakes, seed=args.seed or 0),
+                check_parity(boards=16, ticks=20000, width=13, height=9, snakes=1, seed=args.seed or 0, cycle=True),
+                check_parity(boards=16, ticks=20000, width=13, height=9, snakes=args.snakes, seed=args.seed or 0, cycle=True)]
+        for mismatches, coverage in runs:
+            for m in mismatches[:20]:
+                print(m)
+            print(f"parity: {len(mismatches)} mismatches, " + ", ".join(f"{n} {k}" for k, n in coverage.items()))
+        return
+
+    batch = BatchEngine(args.boards, args.snakes, args.width, args.height, seed=args.seed)
+    batch.reset()
+    rng = np.random.default_rng(args.seed)
+
+    # random turns, never straight back: left, right are indexes 0, 1 and up, down 2, 3
+    start = time.perf_counter()
+    for _ in range(args.ticks):
+        turn = rng.random((args.boards, args.snakes)) < 0.2
+        turns = (batch.directions ^ 2) & ~1 | rng.integers(0, 2, size=(args.boards, args.snakes))
+        batch.step(np.where(turn, turns, -1))
+        batch.reset(batch.done)
+    elapsed = time.perf_counter() - start
+
+    board_ticks = args.boards * args.ticks
+    print(f"{board_ticks} board ticks in {elapsed:.2f} s: {board_ticks / elapsed:.0f} board ticks/s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+from array import array
+import random as rd
+from coord import Coord
+
+
+class OccupancyGrid:
+    '''one byte per cell of the board: empty, wall or the slot of a snake
+
+        covers x in [0, width] and y in [0, height]. snakes update it on
+        every head push and tail pop, so "is this cell taken and by whom"
+        is a lookup instead of a scan over every segment
+    '''
+
+    EMPTY = 0
+    WALL = 255          # also returned for cells outside the grid
+    MAX_SLOTS = WALL - 1
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.row = width + 1
+        self.cells = bytearray(self.row * (height + 1))
+        self.free_cells = None      # optional FreeCellIndex, see track_free_cells
+
+    def in_grid(self, coord):
+        return 0 <= coord.x <= self.width and 0 <= coord.y <= self.height
+
+    def mark_walls(self, left, top, right, bottom):
+        '''cells with x <= left, x >= right, y <= top or y >= bottom become walls'''
+        wall = bytes([OccupancyGrid.WALL])
+        for y in range(self.height + 1):
+            start = y * self.row
+            if y <= top or y >= bottom:
+                self.cells[start:start + self.row] = wall * self.row
+                continue
+
+            self.cells[start:start + left + 1] = wall * (left + 1)
+            if right <= self.width:
+                self.cells[start + right:start + self.row] = wall * (self.row - right)
+
+    def get(self, coord):
+        if not self.in_grid(coord):
+            return OccupancyGrid.WALL
+        return self.cells[coord.y * self.row + coord.x]
+
+    def is_free(self, coord):
+        return self.get(coord) == OccupancyGrid.EMPTY
+
+    def owner(self, coord):
+        '''will return the slot of the snake on coord, None if there is none'''
+        value = self.get(coord)
+        if value == OccupancyGrid.EMPTY or value == OccupancyGrid.WALL:
+            return None
+        return value - 1
+
+    def occupy(self, coord, slot):
+        '''walls and cells outside the grid are left alone'''
+        if self.in_grid(coord):
+            i = coord.y * self.row + coord.x
+            if self.cells[i] != OccupancyGrid.WALL:
+                self.cells[i] = slot + 1
+                if self.free_cells is not None:
+                    self.free_cells.remove(i)
+
+    def release(self, coord, slot):
+        '''frees coord if the snake in slot holds it'''
+        if self.in_grid(coord):
+            i = coord.y * self.row + coord.x
+            if self.cells[i] == slot + 1:
+                self.cells[i] = OccupancyGrid.EMPTY
+                if self.free_cells is not None:
+                    self.free_cells.add(i)
+
+    def occupy_all(self, coords, slot):
+        for c in coords:
+            self.occupy(c, slot)
+
+    def track_free_cells(self, x_space, y_space):
+        '''keeps a FreeCellIndex of the empty cells in x_space x y_space up to date
+            x_space, y_space: inclusive (first, last) tuples like Coord.from_rand
+        '''
+        self.free_cells = FreeCellIndex(self, x_space, y_space)
+        return self.free_cells
+
+
+class FreeCellIndex:
+    '''empty cells of a rectangle of an OccupancyGrid, a random one in O(1)
+
+        cells holds the free cell numbers (y * row + x) in any order and
+        positions maps a cell number to its place in cells, -1 if the cell
+        is taken or outside the rectangle. removing swaps the last cell into
+        the hole, so both updates and picks are constant time
+    '''
+
+    def __init__(self, grid, x_space, y_space):
+        self.grid = grid
+        x1, x2 = x_space
+        y1, y2 = y_space
+
+        self.positions = array('l', [-1]) * len(grid.cells)
+        self.in_space = bytearray(len(grid.cells))
+
+        x1, x2 = max(x1, 0), min(x2, grid.width)
+        n = x2 - x1 + 1
+        self.cells = array('l')
+
+        for y in range(max(y1, 0), min(y2, grid.height) + 1):
+            first = y * grid.row + x1
+            self.in_space[first:first + n] = b'\x01' * n
+
+            if grid.cells.count(OccupancyGrid.EMPTY, first, first + n) == n:
+                # whole row segment free, as on a new board
+                self.positions[first:first + n] = array('l', range(len(self.cells), len(self.cells) + n))
+                self.cells.extend(range(first, first + n))
+                continue
+
+            for i in range(first, first + n):
+                if grid.cells[i] == OccupancyGrid.EMPTY:
+                    self.positions[i] = len(self.cells)
+                    self.cells.append(i)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def is_full(self):
+        return len(self.cells) == 0
+
+    def add(self, i):
+        if self.in_space[i] and self.positions[i] == -1:
+            self.positions[i] = len(self.cells)
+            self.cells.append(i)
+
+    def remove(self, i):
+        pos = self.positions[i]
+        if pos == -1:
+            return
+
+        last = self.cells.pop()
+        if last != i:
+            self.cells[pos] = last
+            self.positions[last] = pos
+        self.positions[i] = -1
+
+    def random_coord(self, rng=rd):
+        '''will return a uniformly random free Coord, None if the board is full'''
+        if self.is_full():
+            return None
+
+        return Coord.from_index(self.cells[rng.randrange(len(self.cells))], self.grid.row)
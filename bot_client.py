@@ -0,0 +1,144 @@
+''' Headless bot player built on game_client.Client
+
+    no curses and no keyboard: the screen size is made up and moves are
+    random or follow a script. every bot keeps timing stats for loadgen.
+'''
+
+import random as rd
+import time
+from coord import Coord
+from engine import OPPOSITE
+from game_client import Client
+import protocol
+from protocol import MsgType
+
+MOVE_TIMEOUT_TICKS = 20     # a move not seen applied by then is not timed
+
+
+class BotStats:
+    def __init__(self):
+        self.connects_s = []        # tcp connect durations
+        self.handshakes_s = []      # username + screen size, until the server said OK
+        self.move_rtts_s = []       # move sent -> first snapshot with the snake turned
+        self.tick_intervals_s = []  # between two applied snapshots
+        self.bytes_received = 0
+        self.games = 0
+        self.results = []
+        self.errors = []
+
+
+class BotClient(Client):
+
+    def __init__(self, user, host, port, screen_size=(40, 120), script=None, move_every=3,
+                 use_udp=False, udp_addr=None, rng=None, stats=None):
+        super().__init__(user, host, port)
+        self.screen_size = screen_size
+        self.script = script            # list of moves played in turn, random if None
+        self.move_every = move_every    # ticks between two moves
+        self.use_udp = use_udp
+        self.udp_addr = udp_addr
+        self.rng = rng if rng is not None else rd.Random()
+
+        self.direction = 'right'
+        self.moves = 0
+        # shared by the bots of one loadgen thread, one bot plays one game
+        self.stats = stats if stats is not None else BotStats()
+
+    def next_move(self):
+        if self.script:
+            return self.script[self.moves % len(self.script)]
+
+        choices = [d for d in Coord.DIRECTIONS if d != self.direction and d != OPPOSITE[self.direction]]
+        return self.rng.choice(choices)
+
+    def play(self, deadline=None):
+        '''plays one game, will return the result or '' if it did not finish'''
+        t0 = time.perf_counter()
+        if not self.connect():
+            self.stats.errors.append('connect')
+            return ''
+        t1 = time.perf_counter()
+        self.stats.connects_s.append(t1 - t0)
+
+        try:
+            if not self.identify_myself():
+                self.stats.errors.append('username')
+                return ''
+            if self.use_udp:
+                self.enable_udp(self.udp_addr)
+            if not self.send_screensize(*self.screen_size):
+                self.stats.errors.append('screen size')
+                return ''
+            self.stats.handshakes_s.append(time.perf_counter() - t1)
+
+            self.start()
+            return self.play_ticks(deadline)
+
+        except (OSError, SystemExit) as e:
+            self.stats.errors.append(f'{type(e).__name__}: {e}')
+            return ''
+        finally:
+            self.stats.bytes_received += self.bytes_received
+            self.sock.close()
+            if self.udp_sock is not None:
+                self.udp_sock.close()
+
+    def play_ticks(self, deadline):
+        ticks = 0
+        last_snapshot = None
+        last_head = None
+        pending = None      # (move, sent, ticks) of the turn in flight
+
+        while True:
+            if deadline is not None and time.perf_counter() > deadline:
+                # no reply wanted, the socket is closed right after
+                self.sock.sendall(protocol.encode(MsgType.QUITTING))
+                return ''
+
+            errno = self.recv_snapshot()
+            if errno == 1 and self.deferred and self.deferred[0][0] == MsgType.ENEMY_QUIT:
+                self.stats.games += 1
+                self.stats.results.append('enemy quit')
+                return 'enemy quit'
+
+            if errno == 1:
+                result, errno = self.recv_game_result()
+                self.send_ack(errno)
+                if errno:
+                    self.stats.errors.append(f'result {errno}')
+                    return ''
+
+                self.stats.games += 1
+                self.stats.results.append(result)
+                return result
+
+            if errno:
+                self.report_error(errno)
+                continue
+
+            now = time.perf_counter()
+            if last_snapshot is not None:
+                self.stats.tick_intervals_s.append(now - last_snapshot)
+            last_snapshot = now
+
+            # moves are not answered, a turn is seen applied when my head goes its way
+            head = self.my_snake_coords[0] if len(self.my_snake_coords) else None
+            if pending is not None and head is not None and last_head is not None:
+                move, sent, sent_ticks = pending
+                if (head.x - last_head.x, head.y - last_head.y) == Coord.DIRECTIONS_MOVES[Coord.DIRECTIONS.index(move)]:
+                    self.stats.move_rtts_s.append(now - sent)
+                    pending = None
+                elif ticks - sent_ticks > MOVE_TIMEOUT_TICKS:
+                    pending = None
+            last_head = head
+
+            ticks += 1
+            if self.move_every and ticks % self.move_every == 0 and pending is None:
+                move = self.next_move()
+                self.moves += 1
+                self.send_move(move)
+
+                # the server drops moves along or against the snake
+                if move != self.direction and move != OPPOSITE[self.direction]:
+                    pending = (move, time.perf_counter(), ticks)
+                    self.direction = move
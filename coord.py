@@ -1,6 +1,14 @@
 import random as rd
 
 class Coord:
+    '''board cell, hashable so it can key sets and dicts
+
+        __slots__ keeps a segment at two attributes and no __dict__.
+        coords are not changed once they are in a SnakeBody, a set or a dict
+    '''
+
+    __slots__ = ('x', 'y')
+
     DIRECTIONS = ['left', 'right', 'up', 'down']
     DIRECTIONS_MOVES = [
         (-1, 0),
@@ -16,18 +24,30 @@ class Coord:
     def coords(self):
         return (self.x, self.y)
 
-    def set_xy(self, coord):
-        self.x = coord.x
-        self.y = coord.y
-
     def same(self, cd):
         if self.x == cd.x and self.y == cd.y:
             return True
         return False
 
     def __eq__(self, other):
+        if not isinstance(other, Coord):
+            return NotImplemented
         return ((self.x == other.x) and (self.y == other.y))
 
+    def __hash__(self):
+        return hash((self.x, self.y))
+
+    def __repr__(self):
+        return f'Coord({self.x}, {self.y})'
+
+    def index(self, row):
+        '''packed cell number y * row + x, row being the board width in cells'''
+        return self.y * row + self.x
+
+    @staticmethod
+    def from_index(i, row):
+        return Coord(i % row, i // row)
+
     @staticmethod
     def from_rand(x_space, y_space):
         ''' x_space: tuple of (x1, x2)
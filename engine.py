@@ -0,0 +1,301 @@
+''' Game rules without curses, sockets or threads
+
+    an Engine holds one board: the snakes, the target and the occupancy
+    grid. step(inputs) plays one tick and returns what happened as events,
+    the server rooms and the single player game only send or draw them.
+
+    python engine.py --ticks 100000 runs random bots as a benchmark
+    python engine.py --check checks the rules on a few set positions
+'''
+
+import argparse
+import hashlib
+import random as rd
+import struct
+import time
+from enum import Enum
+from board import OccupancyGrid
+from coord import Coord
+from snake_body import SnakeBody
+
+INITIAL_SNAKE_LENGTH = 6
+INITIAL_SNAKE_DIRECTION = 'right'
+SCORE_PER_TARGET = 100
+
+OPPOSITE = {'left': 'right', 'right': 'left', 'up': 'down', 'down': 'up'}
+
+# directions a snake can turn to, for the benchmark bots
+TURNS = {'left': ['up', 'down'], 'right': ['up', 'down'], 'up': ['left', 'right'], 'down': ['left', 'right']}
+
+
+class Event(Enum):
+    ATE = 0         # the snake in slot ate the target
+    CRASHED = 1     # its new head hit a wall or a body
+    HEAD_ON = 2     # its new head met another new head
+    BOARD_FULL = 3  # no free cell left for the target, slot is None
+
+# a snake that crashed or met another head dies: its cells are freed and it stops moving
+
+
+class SnakeState:
+    def __init__(self, slot, coords, direction=INITIAL_SNAKE_DIRECTION):
+        self.slot = slot
+        self.body = SnakeBody(coords)
+        self.direction = direction
+        self.score = 0
+        self.grew = False   # the tail was kept on the last step
+        self.alive = True
+
+    def head(self):
+        return self.body.head()
+
+
+def straight_body(head, length=INITIAL_SNAKE_LENGTH):
+    '''head first, the rest of the body to the left of it'''
+    return [Coord(head.x - i, head.y) for i in range(length)]
+
+
+def match_results(snakes, dead):
+    '''dead: slots that died on the last step
+        the dead lose, unless they were the last ones: they died together and draw.
+        when one snake is left it wins and the match is over
+        will return (dict of slot -> 'win', 'loss' or 'draw', match over)
+    '''
+    alive = [s.slot for s in snakes if s.alive]
+    if len(snakes) == 1:
+        # single player, nobody to draw with
+        return {slot: 'loss' for slot in dead}, not alive
+
+    if not alive:
+        return {slot: 'draw' for slot in dead}, True
+
+    results = {slot: 'loss' for slot in dead}
+    if len(alive) == 1:
+        results[alive[0]] = 'win'
+        return results, True
+
+    return results, False
+
+
+def check_rules():
+    '''set positions where the rules are easy to get wrong, raises AssertionError'''
+    # A runs into the body of B, B and C play on: B keeps the cell A hit
+    engine = Engine(30, 20)
+    engine.add_snake(0, straight_body(Coord(14, 10)))
+    engine.add_snake(1, [Coord(15, 12 - i) for i in range(INITIAL_SNAKE_LENGTH)], 'down')
+    engine.add_snake(2, straight_body(Coord(10, 3)))
+    hit = Coord(15, 10)
+
+    events = engine.step()
+    assert events == [(Event.CRASHED, 0)], events
+    assert match_results(engine.snakes, {0}) == ({0: 'loss'}, False)
+    assert engine.grid.owner(hit) == 1
+    assert engine.free_cells.positions[hit.index(engine.grid.row)] == -1
+    assert all(engine.grid.owner(c) == 1 for c in engine.snakes[1].body)
+
+    # two heads on the same cell: both die and the cell is freed once
+    engine = Engine(30, 20)
+    engine.add_snake(0, straight_body(Coord(13, 10)))
+    engine.add_snake(1, [Coord(15 + i, 10) for i in range(INITIAL_SNAKE_LENGTH)], 'left')
+    engine.add_snake(2, straight_body(Coord(10, 3)))
+
+    events = engine.step()
+    assert sorted(events, key=lambda e: e[1]) == [(Event.HEAD_ON, 0), (Event.HEAD_ON, 1)], events
+    assert match_results(engine.snakes, {0, 1}) == ({0: 'loss', 1: 'loss', 2: 'win'}, True)
+    assert engine.grid.is_free(Coord(14, 10))
+    assert len(engine.free_cells) == 29 * 19 - INITIAL_SNAKE_LENGTH
+
+
+class Engine:
+
+    def __init__(self, width, height, walls=None, target_space=None, rng=None, score_per_target=SCORE_PER_TARGET):
+        '''walls: (left, top, right, bottom), cells on or beyond them are walls, default the grid edges
+            target_space: ((x1, x2), (y1, y2)) where targets go, default inside the walls
+        '''
+        self.width = width
+        self.height = height
+        self.rng = rng if rng is not None else rd
+        self.score_per_target = score_per_target
+
+        left, top, right, bottom = walls if walls is not None else (0, 0, width, height)
+        self.grid = OccupancyGrid(width, height)
+        self.grid.mark_walls(left, top, right, bottom)
+
+        if target_space is None:
+            target_space = ((left + 1, right - 1), (top + 1, bottom - 1))
+        self.free_cells = self.grid.track_free_cells(*target_space)
+
+        self.snakes = []            # SnakeState in slot order
+        self.target = None
+        self.target_moved = False   # relocated on the last step
+        self.tick = 0
+
+    def add_snake(self, slot, coords, direction=INITIAL_SNAKE_DIRECTION):
+        '''raises ValueError if slot does not fit in a grid cell'''
+        if not 0 <= slot < OccupancyGrid.MAX_SLOTS:
+            raise ValueError(f"slot {slot} not in [0, {OccupancyGrid.MAX_SLOTS})")
+
+        snake = SnakeState(slot, coords, direction)
+        self.snakes.append(snake)
+        self.grid.occupy_all(snake.body, slot)
+        return snake
+
+    def spawn_snakes(self, count, length=INITIAL_SNAKE_LENGTH, margin=3):
+        '''snakes of length facing right, heads at random on different rows
+            will return the new SnakeStates
+            raises ValueError if the board has fewer rows than snakes
+        '''
+        if count > self.height - 2 * margin + 1:
+            raise ValueError(f"{count} snakes do not fit on {self.height - 2 * margin + 1} rows")
+
+        y_coords = []
+        hy = self.rng.randint(margin, self.height - margin)
+
+        spawned = []
+        for slot in range(len(self.snakes), len(self.snakes) + count):
+            hx = self.rng.randint(length + margin, self.width - margin - length)
+
+            while hy in y_coords:
+                hy = self.rng.randint(margin, self.height - margin)
+            y_coords.append(hy)
+
+            spawned.append(self.add_snake(slot, straight_body(Coord(hx, hy), length)))
+
+        return spawned
+
+    def relocate_target(self):
+        '''moves the target to a random free cell
+            returns False if no cell is free, the target is then None
+        '''
+        self.target = self.free_cells.random_coord(self.rng)
+        self.target_moved = True
+        return self.target is not None
+
+    def kill(self, slot):
+        '''takes the snake off the board, e.g. when its player left'''
+        snake = self.snakes[slot]
+        snake.alive = False
+        for c in snake.body:
+            self.grid.release(c, slot)
+
+    def step(self, inputs=None):
+        '''plays one tick
+            inputs: dict of slot -> direction, applied before the move
+            will return the list of (Event, slot)
+        '''
+        events = []
+        alive = [snake for snake in self.snakes if snake.alive]
+
+        for snake in self.snakes:
+            snake.grew = False
+        self.target_moved = False
+
+        if inputs:
+            for slot, direction in inputs.items():
+                if self.snakes[slot].alive:
+                    self.snakes[slot].direction = direction
+
+        # a snake on the target eats it, its tail stays on this move
+        eater = self.grid.owner(self.target) if self.target is not None else None
+        if eater is not None:
+            snake = self.snakes[eater]
+            snake.body.grow()
+            snake.grew = True
+            snake.score += self.score_per_target
+            events.append((Event.ATE, eater))
+
+            if not self.relocate_target():
+                events.append((Event.BOARD_FULL, None))
+
+        moves = [(snake, snake.body.move(snake.direction)) for snake in alive]
+
+        # tails go first: a head may take a cell left by a tail on the same tick
+        for snake, (_, tail) in moves:
+            if tail is not None:
+                self.grid.release(tail, snake.slot)
+
+        # one pass over the new heads: the grid answers for walls and bodies,
+        # heads answers for the heads placed before on this tick
+        heads = {}
+        dead = set()
+        for snake, (head, _) in moves:
+            if head in heads:
+                events.append((Event.HEAD_ON, heads[head]))
+                events.append((Event.HEAD_ON, snake.slot))
+                dead.add(heads[head])
+                dead.add(snake.slot)
+                continue
+            heads[head] = snake.slot
+
+            # a crashed head does not take the cell, it stays with its owner
+            if not self.grid.is_free(head):
+                events.append((Event.CRASHED, snake.slot))
+                dead.add(snake.slot)
+            else:
+                self.grid.occupy(head, snake.slot)
+
+        # deaths are simultaneous: every check above saw the bodies of this tick
+        for slot in sorted(dead):
+            self.kill(slot)
+
+        self.tick += 1
+        return events
+
+    def state_hash(self):
+        '''hex digest of the tick, grid, target and snakes, to compare two runs of a match'''
+        h = hashlib.blake2b(digest_size=16)
+        h.update(struct.pack('<I', self.tick))
+        h.update(self.grid.cells)
+
+        target = self.target.index(self.grid.row) if self.target is not None else -1
+        h.update(struct.pack('<i', target))
+
+        for snake in self.snakes:
+            h.update(struct.pack('<BBBII', snake.slot, Coord.DIRECTIONS.index(snake.direction), snake.alive,
+                                 snake.score, snake.body.pending_growth))
+            h.update(struct.pack(f'<{len(snake.body)}i', *(c.index(self.grid.row) for c in snake.body)))
+
+        return h.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark of the headless engine with random bots")
+    parser.add_argument('--ticks', type=int, default=100000)
+    parser.add_argument('--snakes', type=int, default=2)
+    parser.add_argument('--width', type=int, default=120)
+    parser.add_argument('--height', type=int, default=40)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--check', action='store_true', help="check the rules on set positions instead")
+    args = parser.parse_args()
+
+    if args.check:
+        check_rules()
+        print("rules ok")
+        return
+
+    rng = rd.Random(args.seed)
+    ticks = games = 0
+    start = time.perf_counter()
+
+    while ticks < args.ticks:
+        engine = Engine(args.width, args.height, rng=rng)
+        engine.spawn_snakes(args.snakes)
+        engine.relocate_target()
+        games += 1
+
+        while ticks < args.ticks:
+            # a random turn now and then, never straight back
+            inputs = {s.slot: rng.choice(TURNS[s.direction]) for s in engine.snakes if s.alive and rng.random() < 0.2}
+            events = engine.step(inputs)
+            ticks += 1
+
+            dead = {slot for kind, slot in events if kind in (Event.CRASHED, Event.HEAD_ON)}
+            _, over = match_results(engine.snakes, dead)
+            if over or any(kind == Event.BOARD_FULL for kind, _ in events):
+                break
+
+    elapsed = time.perf_counter() - start
+    print(f"{ticks} ticks in {elapsed:.2f} s: {ticks / elapsed:.0f} ticks/s, {games} games")
+
+if __name__ == '__main__':
+    main()
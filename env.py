@@ -0,0 +1,315 @@
+''' Reset/step environments over the game rules, for training and evaluating bots (needs numpy)
+
+    SnakeEnv(players=1) plays the single player game of SnakeGame.start_sp:
+    the plane of a rows x cols screen, reversals ignored like Snake.set_direction,
+    100 points and GAME_SPEED + 5 per target. SnakeEnv(players=2) plays a room
+    of the server against opponent policies (players=N for N snakes): its
+    walls and target space, moves along or against the snake dropped like
+    Player.next_move, results as in Room.step.
+
+    observations: 'grid' is a (5, rows, cols) tensor of walls, own body,
+    own head, enemy bodies and the target. 'ego' is the same channels in a
+    window around the head, turned so the snake always heads up.
+
+    python env.py --envs 64 --workers 4 --steps 2000   steps/second
+'''
+
+import argparse
+import multiprocessing
+import random as rd
+import time
+import numpy as np
+from board import OccupancyGrid
+from coord import Coord
+from engine import Engine, Event, INITIAL_SNAKE_LENGTH, OPPOSITE, SCORE_PER_TARGET, match_results, straight_body
+
+ACTIONS = Coord.DIRECTIONS     # an action is an index in this list
+
+# same values as SnakeGame
+GAME_SPEED = 100
+GAME_SPEED_PER_TARGET = 5
+
+CHANNELS = 5    # walls, own body, own head, enemy bodies, target
+EGO_RADIUS = 7
+
+
+def random_opponent(env, slot):
+    '''turns now and then, never straight back'''
+    direction = env.engine.snakes[slot].direction
+    if env.rng.random() < 0.2:
+        return env.rng.choice([d for d in ACTIONS if d != direction and d != OPPOSITE[direction]])
+    return None
+
+
+class SnakeEnv:
+
+    def __init__(self, rows=30, cols=110, players=1, observation='grid', ego_radius=EGO_RADIUS,
+                 max_ticks=10000, opponent=random_opponent, seed=None):
+        self.rows = rows
+        self.cols = cols
+        self.players = players
+        self.observation = observation
+        self.ego_radius = ego_radius
+        self.max_ticks = max_ticks
+        self.opponent = opponent
+        self.rng = rd.Random(seed)
+
+        self.engine = None
+        self.score = 0
+        self.game_speed = GAME_SPEED
+
+    def observation_shape(self):
+        if self.observation == 'ego':
+            side = 2 * self.ego_radius + 1
+            return (CHANNELS, side, side)
+        return (CHANNELS, self.rows, self.cols)
+
+    def reset(self):
+        '''will return the first observation'''
+        if self.players == 1:
+            # the plane of SnakeGame: Plane(x=1, y=2, width=cols-2, height=rows-3)
+            left, top, right, bottom = 1, 2, self.cols - 1, self.rows - 1
+            self.engine = Engine(right, bottom, walls=(left, top, right, bottom), rng=self.rng)
+
+            # as Snake.init_coords
+            hx = self.rng.randint(left + INITIAL_SNAKE_LENGTH, right - 1)
+            hy = self.rng.randint(top + 1, bottom - 1)
+            self.engine.add_snake(0, straight_body(Coord(hx, hy)))
+        else:
+            # a room with the screen size of its players
+            self.engine = Engine(self.cols, self.rows, walls=(0, 1, self.cols, self.rows),
+                                 target_space=((3, self.cols - 3), (3, self.rows - 3)), rng=self.rng)
+            self.engine.spawn_snakes(self.players)
+
+        self.engine.relocate_target()
+        self.score = 0
+        self.game_speed = GAME_SPEED
+        return self.observe()
+
+    def step(self, action):
+        '''action: index in ACTIONS for snake 0
+            will return (observation, reward, done, info)
+            reward: +1 per target, and at the end -1 for a loss, +1 for a win, 0 for a draw
+        '''
+        direction = ACTIONS[action]
+        inputs = {}
+
+        if self.players == 1:
+            # Snake.set_direction ignores reversals
+            if direction != OPPOSITE[self.engine.snakes[0].direction]:
+                inputs[0] = direction
+        else:
+            moves = {0: direction}
+            for slot in range(1, self.players):
+                if self.engine.snakes[slot].alive:
+                    moves[slot] = self.opponent(self, slot)
+
+            # Player.next_move drops moves along or against the snake
+            for slot, move in moves.items():
+                current = self.engine.snakes[slot].direction
+                if move is not None and move != current and move != OPPOSITE[current]:
+                    inputs[slot] = move
+
+        events = self.engine.step(inputs)
+
+        reward = 0.0
+        dead = set()
+        board_full = False
+        for kind, slot in events:
+            if kind == Event.ATE and slot == 0:
+                reward += 1.0
+                self.score += SCORE_PER_TARGET
+                self.game_speed += GAME_SPEED_PER_TARGET
+            elif kind == Event.HEAD_ON or kind == Event.CRASHED:
+                dead.add(slot)
+            elif kind == Event.BOARD_FULL:
+                board_full = True
+
+        # snake 0 is done once it has a result, as its player in Room.step
+        results, _ = match_results(self.engine.snakes, dead)
+        result = results.get(0)
+        if result is None and board_full:
+            result = 'draw'
+        if result == 'loss':
+            reward -= 1.0
+        elif result == 'win':
+            reward += 1.0
+
+        done = result is not None or self.engine.tick >= self.max_ticks
+        info = {
+            'tick': self.engine.tick,
+            'score': self.score,
+            'game_speed': self.game_speed,
+            'frame_seconds': 10 / self.game_speed,  # SnakeGame's sleep between frames
+            'result': result,
+        }
+        return self.observe(), reward, done, info
+
+    def observe(self):
+        cells = np.frombuffer(self.engine.grid.cells, dtype=np.uint8).reshape(self.engine.height + 1, self.engine.width + 1)
+        head = self.engine.snakes[0].head()
+
+        planes = np.zeros((CHANNELS,) + cells.shape, dtype=np.uint8)
+        planes[0] = cells == OccupancyGrid.WALL
+        planes[1] = cells == 1
+        planes[3] = (cells != OccupancyGrid.EMPTY) & (cells != OccupancyGrid.WALL) & (cells != 1)
+        if self.engine.grid.in_grid(head):
+            planes[2, head.y, head.x] = 1
+        if self.engine.target is not None:
+            planes[4, self.engine.target.y, self.engine.target.x] = 1
+
+        if self.observation == 'ego':
+            return self.egocentric(planes, head)
+
+        # the whole screen, the board is at its top left
+        obs = np.zeros((CHANNELS, self.rows, self.cols), dtype=np.uint8)
+        h, w = min(self.rows, planes.shape[1]), min(self.cols, planes.shape[2])
+        obs[:, :h, :w] = planes[:, :h, :w]
+        return obs
+
+    def egocentric(self, planes, head):
+        r = self.ego_radius
+        padded = np.pad(planes, ((0, 0), (r, r), (r, r)))
+        padded[0, :r, :] = padded[0, -r:, :] = 1
+        padded[0, :, :r] = padded[0, :, -r:] = 1
+
+        window = padded[:, head.y:head.y + 2 * r + 1, head.x:head.x + 2 * r + 1]
+
+        # quarter turns counterclockwise that bring the heading up
+        turns = {'up': 0, 'right': 1, 'down': 2, 'left': 3}[self.engine.snakes[0].direction]
+        return np.ascontiguousarray(np.rot90(window, turns, axes=(1, 2)))
+
+
+class VecEnv:
+    '''steps several SnakeEnvs in this process, finished ones start over'''
+
+    def __init__(self, envs):
+        self.envs = envs
+
+    def reset(self):
+        return np.stack([env.reset() for env in self.envs])
+
+    def step(self, actions):
+        '''will return stacked (observations, rewards, dones, infos)
+            the observation of a finished env is the first one of its next game
+        '''
+        observations, rewards, dones, infos = [], [], [], []
+        for env, action in zip(self.envs, actions):
+            obs, reward, done, info = env.step(action)
+            if done:
+                obs = env.reset()
+            observations.append(obs)
+            rewards.append(reward)
+            dones.append(done)
+            infos.append(info)
+
+        return np.stack(observations), np.array(rewards, dtype=np.float32), np.array(dones), infos
+
+    def close(self):
+        pass
+
+
+def run_vec_worker(conn, env_kwargs):
+    vec = VecEnv([SnakeEnv(**kwargs) for kwargs in env_kwargs])
+    try:
+        while True:
+            command, data = conn.recv()
+            if command == 'reset':
+                conn.send(vec.reset())
+            elif command == 'step':
+                conn.send(vec.step(data))
+            elif command == 'close':
+                break
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        conn.close()
+
+
+class ProcessVecEnv:
+    '''splits the envs over worker processes, every step goes to all of them at once'''
+
+    def __init__(self, env_kwargs, workers):
+        ctx = multiprocessing.get_context('fork')
+        chunks = [env_kwargs[i::workers] for i in range(workers)]
+        # env i runs in worker i % workers
+        self.order = np.argsort(np.concatenate([np.arange(len(env_kwargs))[i::workers] for i in range(workers)]))
+
+        self.conns = []
+        self.processes = []
+        for chunk in chunks:
+            if not chunk:
+                continue
+            conn, worker_conn = ctx.Pipe()
+            p = ctx.Process(target=run_vec_worker, args=(worker_conn, chunk), daemon=True)
+            p.start()
+            worker_conn.close()
+            self.conns.append(conn)
+            self.processes.append(p)
+
+        self.workers = len(self.conns)
+
+    def reset(self):
+        for conn in self.conns:
+            conn.send(('reset', None))
+        return np.concatenate([conn.recv() for conn in self.conns])[self.order]
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        for i, conn in enumerate(self.conns):
+            conn.send(('step', actions[i::self.workers]))
+
+        results = [conn.recv() for conn in self.conns]
+        observations = np.concatenate([r[0] for r in results])[self.order]
+        rewards = np.concatenate([r[1] for r in results])[self.order]
+        dones = np.concatenate([r[2] for r in results])[self.order]
+        infos = [info for r in results for info in r[3]]
+        infos = [infos[i] for i in self.order]
+        return observations, rewards, dones, infos
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(('close', None))
+            conn.close()
+        for p in self.processes:
+            p.join()
+
+
+def make_vec_env(envs, workers=0, seed=0, **env_kwargs):
+    '''envs SnakeEnvs in this process (workers=0) or spread over worker processes'''
+    kwargs = [dict(env_kwargs, seed=seed + i) for i in range(envs)]
+    if workers:
+        return ProcessVecEnv(kwargs, workers)
+    return VecEnv([SnakeEnv(**k) for k in kwargs])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="steps/second of vectorized snake environments with random actions")
+    parser.add_argument('--envs', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=0, help="worker processes, 0 steps in this process")
+    parser.add_argument('--steps', type=int, default=1000, help="vector steps")
+    parser.add_argument('--players', type=int, default=1)
+    parser.add_argument('--observation', choices=['grid', 'ego'], default='grid')
+    parser.add_argument('--rows', type=int, default=30)
+    parser.add_argument('--cols', type=int, default=110)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    vec = make_vec_env(args.envs, args.workers, args.seed, rows=args.rows, cols=args.cols,
+                       players=args.players, observation=args.observation)
+    rng = np.random.default_rng(args.seed)
+
+    obs = vec.reset()
+    games = 0
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        obs, rewards, dones, infos = vec.step(rng.integers(0, len(ACTIONS), size=args.envs))
+        games += int(dones.sum())
+    elapsed = time.perf_counter() - start
+    vec.close()
+
+    steps = args.envs * args.steps
+    print(f"observations {obs.shape}, {steps} steps in {elapsed:.2f} s: {steps / elapsed:.0f} steps/s, {games} games")
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,14 @@
 #!python3
 
 import random as rd
+import selectors
+import sys
 import time
 import curses
-from pynput import keyboard
-from pynput.keyboard import Key
 import socket
 from coord import Coord
+from snake_body import SnakeBody
+from engine import Engine, Event, OPPOSITE
 from game_client import Client
 
 COLOR_GREEN = 80
@@ -16,6 +18,12 @@ COLOR_RED = 10
 COLOR_YELLOW = 150
 COLOR_MAGENTA = 90
 
+# multiplayer snapshots over udp (moves and results stay on tcp)
+USE_UDP_SNAPSHOTS = False
+MP_FRAME_SECONDS = 0.02     # longest wait for snapshots between two frames
+KEY_ESC = 27
+ESC_DELAY_MS = 25
+
 
 class Plane:
     def __init__(self, screen, x=1, y=2, width=110, height=30):
@@ -36,18 +44,6 @@ class Plane:
             self.screen.addstr(i, self.x + self.width, '|', curses.color_pair(COLOR_PURPLE))
 
 
-    def does_snake_touch_bounds(self, snake):
-        # get head coords
-        head = snake.get_head()
-        hx, hy = (head.x, head.y)
-
-        if hx <= self.x or hx >= (self.x + self.width):
-            return True
-        if hy <= self.y or hy >= (self.y + self.height):
-            return True
-
-        return False
-
     def erase_snake(self, __snake):
         '''replace snake with spaces'''
         for c in __snake.coords:
@@ -57,8 +53,7 @@ class Plane:
         dchar = Snake.SNAKE_HEAD_CHAR
         dcolor = COLOR_RED
         body_len = len(__snake.coords)
-        for i in range(body_len):
-            body_part_coord = __snake.coords[i]
+        for i, body_part_coord in enumerate(__snake.coords):
             if i == (body_len - 1):
                 dchar = Snake.SNAKE_TAIL_CHAR
             self.screen.addstr(body_part_coord.y, body_part_coord.x, dchar, curses.color_pair(dcolor))
@@ -88,12 +83,8 @@ class Plane:
     def right_edge(self):
         return self.x + self.width
 
-    def randomize_within_bounds(self):
-        tx = rd.randint(self.left_edge()+1, self.right_edge()-1)
-        ty = rd.randint(self.top_edge()+1, self.bottom_edge()-1)
-        return (tx, ty)
-
-    def draw_countdown(self, start_time_seconds):
+    def draw_countdown(self, start_ns):
+        '''counts down to start_ns on the monotonic clock, returns at that instant'''
         countdown_message = f'GAME STARTS IN: '
         middle_x = self.x + int(self.width/2)
         middle_y = self.y + int(self.height/2)
@@ -106,20 +97,77 @@ class Plane:
             self.screen.addstr(middle_y+i, msg_start_x-2, '|' + ' '*(len(countdown_message)+3) + '|', curses.color_pair(COLOR_GREEN))
 
         self.screen.refresh()
-        # draw countdown message with correct time
+        # draw the whole seconds left, sleep to the next one or to the start
         while True:
-            current_time_seconds = int(time.strftime("%S"))
-            time_left = (start_time_seconds-current_time_seconds)%60
-            self.screen.addstr(middle_y, msg_start_x, countdown_message + str(time_left), curses.color_pair(COLOR_GREEN))
-            self.screen.refresh()
-            time.sleep(1)
-            if time_left == 1:
+            ns_left = start_ns - time.monotonic_ns()
+            if ns_left <= 0:
                 # replace everything with spaces
                 for i in range(-2, 3):
                     self.screen.addstr(middle_y+i, msg_start_x-2, ' '*(len(countdown_message)+7))
                 self.screen.refresh()
                 return
 
+            time_left = -(-ns_left // 1_000_000_000)
+            self.screen.addstr(middle_y, msg_start_x, countdown_message + str(time_left), curses.color_pair(COLOR_GREEN))
+            self.screen.refresh()
+            time.sleep((ns_left - (time_left - 1) * 1_000_000_000) / 1e9)
+
+
+class FrameRenderer:
+    '''draws only the cells that changed since the last frame
+
+        the border is drawn once. a moving snake changes its new head, the
+        old head (now body), its tail and the cell the tail left, so a frame
+        is a few addstr calls whatever the size of the screen
+    '''
+
+    def __init__(self, plane):
+        self.plane = plane
+        self.screen = plane.screen
+        self.drawn_tails = {}       # key -> tail coord as drawn
+        self.drawn_target = None
+        self.drawn_points = None
+
+    def draw_static(self):
+        self.screen.clear()
+        self.plane.draw()
+
+    def draw_frame(self, snakes, target, score):
+        '''snakes: dict of key -> Snake, e.g. the player's slot'''
+        # an eaten target is under the snake, which is drawn over it
+        if self.drawn_target is not None and self.drawn_target != target.coords:
+            self.screen.addstr(self.drawn_target.y, self.drawn_target.x, ' ')
+            self.drawn_target = None
+
+        for key, snake in snakes.items():
+            self.draw_snake_changes(key, snake)
+
+        if target.coords is not None and self.drawn_target != target.coords:
+            self.plane.draw_target(target)
+            self.drawn_target = target.coords
+
+        if score.points != self.drawn_points:
+            self.plane.draw_score(score)
+            self.drawn_points = score.points
+
+    def draw_snake_changes(self, key, snake):
+        body = snake.coords
+        if len(body) == 0:
+            return
+
+        # the cell left by the tail, unless the head took it on the same tick
+        old_tail = self.drawn_tails.get(key)
+        if old_tail is not None and old_tail != body.tail():
+            self.screen.addstr(old_tail.y, old_tail.x, ' ')
+
+        if len(body) > 2:
+            self.screen.addstr(body[1].y, body[1].x, Snake.SNAKE_BODY_CHAR, curses.color_pair(COLOR_YELLOW))
+        if len(body) > 1:
+            self.screen.addstr(body.tail().y, body.tail().x, Snake.SNAKE_TAIL_CHAR, curses.color_pair(COLOR_YELLOW))
+        self.screen.addstr(body.head().y, body.head().x, Snake.SNAKE_HEAD_CHAR, curses.color_pair(COLOR_RED))
+
+        self.drawn_tails[key] = body.tail()
+
 
 class Snake:
 
@@ -127,10 +175,11 @@ class Snake:
     SNAKE_HEAD_CHAR = '@'
     SNAKE_TAIL_CHAR = '+'
 
-    def __init__(self, plane):
+    def __init__(self, plane, rng=rd):
         self.length = 6
-        self.coords = []  # list of coords with head at pos 0
+        self.coords = SnakeBody()  # head at pos 0
         self.plane = plane
+        self.rng = rng
         self.is_paused = True
 
         # default direction of the snake
@@ -139,116 +188,41 @@ class Snake:
         # init coords
         self.init_coords(self.length)
 
-    def get_head(self):
-        return self.coords[0]
-
     def set_coords(self, coord_list):
-        self.coords = []
-        for c in coord_list:
-            self.coords.append(c)
+        self.coords = SnakeBody(coord_list)
+        self.length = len(self.coords)
 
 
     def init_coords(self, length):
-        hx = rd.randint(self.plane.left_edge()+self.length, self.plane.right_edge()-1)
-        hy = rd.randint(self.plane.top_edge()+1, self.plane.bottom_edge()-1)
-        self.coords.append(Coord(hx, hy))
+        hx = self.rng.randint(self.plane.left_edge()+self.length, self.plane.right_edge()-1)
+        hy = self.rng.randint(self.plane.top_edge()+1, self.plane.bottom_edge()-1)
+        body = [Coord(hx, hy)]
 
         # append rest of the body
         for i in range(self.length-1):
-            self.coords.append(Coord(hx - i - 1, hy))
-
-    def move(self, direction):
-        pos = Coord.DIRECTIONS.index(direction)
-        hx = self.coords[0].x + Coord.DIRECTIONS_MOVES[pos][0]
-        hy = self.coords[0].y + Coord.DIRECTIONS_MOVES[pos][1]
-
-        # body chain follow
-        tmp = Coord(self.coords[0].x, self.coords[0].y)
-
-        for i in range(1, self.length):
-            tmp2 = Coord(self.coords[i].x, self.coords[i].y)
-            self.coords[i].set_xy(tmp)
-            tmp.set_xy(tmp2)
-
-        # set new head position
-        self.coords[0].x = hx
-        self.coords[0].y = hy
-
-    def touches_itself(self):
-        head = self.coords[0]
-        for i in range(1, self.length):
-            body_cd = self.coords[i]
-            if head.same(body_cd):
-                return True
-        return False
-
-    def touches_enemy_snake(self, enemy_snake):
-        head = self.coords[0]
-        for i in range(1, enemy_snake.length):
-            enemy_snake_cd = enemy_snake.coords[i]
-            if head.same(enemy_snake_cd):
-                return True
-        return False
-
-    def progress(self):
-        if not self.is_paused:
-            self.move(self.direction)
+            body.append(Coord(hx - i - 1, hy))
+
+        self.coords = SnakeBody(body)
 
     def set_pause(self, pauz):
         self.is_paused = pauz
 
     def set_direction(self, d):
-        if Snake.are_directions_opposite(d, self.direction):
+        if d == OPPOSITE[self.direction]:
             return
         self.direction = d
 
-    def grow(self):
-        self.length += 1
-        self.coords.append(Coord(self.coords[-1].x, self.coords[-1].y))
-
-
-    def eat_target(self, _target):
-        if _target.coords.same(self.coords[0]):
-            _target.generate_target()
-            self.grow()
-            return True
-        return False
-
-    @staticmethod
-    def are_directions_opposite(d1, d2):
-        opposites = [
-            ('left', 'right'),
-            ('up', 'down')
-        ]
-        if (d1, d2) in opposites or (d2, d1) in opposites:
-            return True
-        return False
-
 
 class Target:
 
     TARGET_CHAR = 'X'
 
-    def __init__(self, snake, plane):
-        self.coords = None
-        self.snake = snake
-        self.plane = plane
-        self.generate_target()
+    def __init__(self):
+        self.coords = None  # placed by the engine or the server
 
     def set_coords(self, x, y):
         self.coords = Coord(x, y)
 
-    def generate_target(self):
-        tx, ty = (0, 0)
-        while True:
-            tx, ty = self.plane.randomize_within_bounds()
-            tcoords = Coord(tx, ty)
-            # verify target doesn't overlap with the snake body
-            for i in range(self.snake.length):
-                if self.snake.coords[i].same(tcoords):
-                    continue
-            break
-        self.coords = Coord(tx, ty)
 
 class Score:
     def __init__(self):
@@ -260,19 +234,23 @@ class Score:
 
 class SnakeGame:
 
-    def __init__(self, screen):
+    def __init__(self, screen, seed=None):
         self.screen = screen
         self.rows, self.cols = screen.getmaxyx()
         self.STOP_GAME = False
 
+        # single player games are reproducible from their seed
+        self.seed = seed if seed is not None else rd.getrandbits(32)
+        self.rng = rd.Random(self.seed)
+
         self.plane = Plane(screen, width=self.cols-2, height=self.rows-3)
-        self.snake = Snake(self.plane)
-        self.target = Target(self.snake, self.plane)
+        self.snake = Snake(self.plane, self.rng)
+        self.target = Target()
         self.score = Score()
         self.GAME_SPEED = 100
+        self.engine = None  # rules of the single player game
 
-        # captue key events & set direction accordingly
-        self.listener = keyboard.Listener(on_press=self.on_press)
+        # keys are read in the game loops, when the terminal has some
         self.made_move = False
 
         # intialize game, curses...
@@ -305,69 +283,107 @@ class SnakeGame:
 
     # start game in single player mode
     def start_sp(self):
-        self.listener.start()
+        # the plane border is the wall
+        self.engine = Engine(self.plane.right_edge(), self.plane.bottom_edge(),
+                             walls=(self.plane.left_edge(), self.plane.top_edge(), self.plane.right_edge(), self.plane.bottom_edge()),
+                             rng=self.rng)
+
+        # the engine moves the snake's body, the plane draws it
+        self.snake.coords = self.engine.add_snake(0, self.snake.coords, self.snake.direction).body
+        self.engine.relocate_target()
+        self.target.coords = self.engine.target
+
+        # the whole snake once, then only the cells that change
+        renderer = FrameRenderer(self.plane)
+        renderer.draw_static()
+        self.plane.draw_snake(self.snake)
+
+        renderer.draw_frame({0: self.snake}, self.target, self.score)
+        self.screen.refresh()
+
+        # one loop: keys when the terminal has some, a step when the frame is due
+        selector = self.key_selector()
+        next_frame = time.monotonic() + 10 / self.GAME_SPEED
         while True:
-            did_snake_eat_target = self.snake.eat_target(self.target)
+            timeout = next_frame - time.monotonic()
+            if timeout > 0:
+                if selector.select(timeout):
+                    self.read_keys()
+                if self.STOP_GAME:
+                    break
+                continue
 
-            if(did_snake_eat_target):
-                self.score.increment()
-                self.GAME_SPEED += 5
+            # fps scheduler, a late frame does not make the next ones hurry
+            next_frame = max(next_frame + 10 / self.GAME_SPEED, time.monotonic())
+
+            events = []
+            if not self.snake.is_paused:
+                events = self.engine.step({0: self.snake.direction})
+
+            crashed = False
+            for kind, _ in events:
+                if kind == Event.ATE:
+                    self.score.increment()
+                    self.GAME_SPEED += 5
+                elif kind == Event.BOARD_FULL:
+                    self.game_over('The board is full!')
+                elif kind == Event.CRASHED:
+                    crashed = True
+            self.target.coords = self.engine.target
+
+            if crashed:
+                break
 
-            self.plane.draw()
-            self.plane.draw_snake(self.snake)
-            self.plane.draw_target(self.target)
-            self.plane.draw_score(self.score)
+            renderer.draw_frame({0: self.snake}, self.target, self.score)
 
             # refresh screen
             self.screen.refresh()
 
-            # fps scheduler
-            time.sleep(10 / self.GAME_SPEED)
-
-            self.snake.progress()
-
-            if self.plane.does_snake_touch_bounds(self.snake) or self.snake.touches_itself() or self.STOP_GAME:
-                self.screen.clear()
-                self.game_over()
-                break
-
-            # curses.endwin()
-            self.screen.clear()
-
         self.game_over()
 
-    def on_press(self, key):
-        try:
-            if key==Key.up:
-                self.snake.set_pause(False)
-                self.snake.set_direction('up')
-            elif key==Key.down:
-                self.snake.set_pause(False)
-                self.snake.set_direction('down')
-            elif key==Key.right:
-                self.snake.set_pause(False)
-                self.snake.set_direction('right')
-            elif key==Key.left:
-                self.snake.set_pause(False)
-                self.snake.set_direction('left')
-            elif key==Key.space:
-                self.snake.set_pause(True)
-            elif key==Key.esc:
-                self.stop_game()
-            else:
-                pass
-
-        except AttributeError:
-            pass
+    def key_selector(self):
+        '''a selector on the terminal input, keys are then read without blocking'''
+        curses.cbreak()
+        curses.noecho()
+        self.screen.nodelay(True)
+        self.screen.keypad(True)
+        selector = selectors.DefaultSelector()
+        selector.register(sys.stdin, selectors.EVENT_READ, 'keys')
+        return selector
+
+    def read_keys(self):
+        '''handles every key the terminal has'''
+        while True:
+            key = self.screen.getch()
+            if key == -1:
+                return
+            self.on_key(key)
+
+    def on_key(self, key):
+        '''key: curses key code'''
+        if key == curses.KEY_UP:
+            self.snake.set_pause(False)
+            self.snake.set_direction('up')
+        elif key == curses.KEY_DOWN:
+            self.snake.set_pause(False)
+            self.snake.set_direction('down')
+        elif key == curses.KEY_RIGHT:
+            self.snake.set_pause(False)
+            self.snake.set_direction('right')
+        elif key == curses.KEY_LEFT:
+            self.snake.set_pause(False)
+            self.snake.set_direction('left')
+        elif key == ord(' '):
+            self.snake.set_pause(True)
+        elif key == KEY_ESC:
+            self.stop_game()
 
         self.made_move = True
 
-
     def stop_game(self):
         self.STOP_GAME = True
 
     def game_over(self, result=''):
-        self.listener.stop()
         self.screen.clear()
         self.screen.refresh()
         print('GAME OVER....')
@@ -403,16 +419,28 @@ class SnakeGame:
         self.screen.addstr(mid_y, mid_x, id_phrase, curses.color_pair(COLOR_GREEN))
         self.screen.refresh()
 
+        curses.echo()
         username = bytes.decode(self.screen.getstr(mid_y, mid_x+len(id_phrase)))
+        curses.noecho()
         self.screen.clear()
         self.screen.refresh()
         return username
 
+    def update_enemy_snakes(self, enemy_snakes, coords_by_slot):
+        '''enemy_snakes: slot -> Snake, follows the snakes of the last snapshot'''
+        for slot in list(enemy_snakes):
+            if slot not in coords_by_slot:
+                del enemy_snakes[slot]
+
+        for slot, coords in coords_by_slot.items():
+            if slot not in enemy_snakes:
+                enemy_snakes[slot] = Snake(self.plane)
+            enemy_snakes[slot].set_coords(coords)
+
     def start_mp(self):
         # get username from the player
         self.screen.clear()
         self.screen.refresh()
-        self.screen.getstr()
 
         self.draw_full_screen_border()
         username = self.get_username()
@@ -435,6 +463,10 @@ class SnakeGame:
                 continue
             break
 
+        if USE_UDP_SNAPSHOTS:
+            # falls back to tcp if the server does not offer udp
+            gameClient.enable_udp()
+
         self.screen.clear()
         self.draw_full_screen_border()
         self.display_waiting_message()
@@ -453,13 +485,11 @@ class SnakeGame:
         self.plane = Plane(self.screen, width=self.cols-2, height=self.rows-3)
         self.snake.set_coords(gameClient.my_snake_coords)
 
-        enemy_snake = Snake(self.plane)
-        enemy_snake.set_coords(gameClient.enemy_snake_coords)
-        snakes = [self.snake, enemy_snake]
+        enemy_snakes = {}   # slot -> Snake of every other player still in the match
+        self.update_enemy_snakes(enemy_snakes, gameClient.enemy_snakes_coords)
+        snakes = [self.snake] + list(enemy_snakes.values())
 
-        # start key listener and clear screen
-        self.listener.start()
-        time.sleep(1)
+        # clear screen
         self.screen.refresh()
         self.screen.clear()
 
@@ -469,22 +499,28 @@ class SnakeGame:
         self.plane.draw_score(self.score)
         for _snake in snakes: self.plane.draw_snake(_snake)
         self.screen.refresh()
-        self.plane.draw_countdown(gameClient.starting_time)
+        self.plane.draw_countdown(gameClient.start_ns)
 
         # redraw snakes and target in case covered by countdown
         for _snake in snakes: self.plane.draw_snake(_snake)
         self.plane.draw_target(self.target)
         self.screen.refresh()
 
-        while True:
-            do_snakes_touch_heads = snakes[0].get_head().same(snakes[1].get_head())
-            for _snake in snakes:
-                if self.plane.does_snake_touch_bounds(_snake) or _snake.touches_itself() or do_snakes_touch_heads:
-                    result, errno = gameClient.recv_game_result()
-                    if not errno:
-                        self.game_over(f'It\'s a {result}!')
+        # my snake is drawn ahead of the snapshots and the others a steady tick behind,
+        # so keys answer at once and bunched snapshots do not show, see prediction.py
+        gameClient.enable_prediction()
+        drawn_frame = None
 
-                    print(f"Could not understand result message, error {errno}")
+        # one loop: keys and snapshots when they arrive, a frame at least every MP_FRAME_SECONDS
+        selector = self.key_selector()
+        selector.register(gameClient.sock, selectors.EVENT_READ, 'server')
+        if gameClient.udp_sock is not None:
+            selector.register(gameClient.udp_sock, selectors.EVENT_READ, 'server')
+
+        while True:
+            events = selector.select(MP_FRAME_SECONDS)
+            if any(key.data == 'keys' for key, _ in events):
+                self.read_keys()
 
             if self.STOP_GAME:
                 if not gameClient.send_quit():
@@ -497,45 +533,50 @@ class SnakeGame:
                     self.game_over()
                 self.made_move = False
 
-            # get my snake and enemy coords from the server
-            my_coords, errno = gameClient.recv_my_coords()
-            gameClient.sock.sendall(str.encode(str(errno)))
-            if errno:
+            # apply the snapshots of snakes, scores and target that arrived
+            # snapshots are not acked, a bad one is reported and fixed by the next keyframe
+            errno = gameClient.poll_snapshots(0)
+            if errno == 1:
+                # not a snapshot, the server ended the game
+                result, errno = gameClient.recv_game_result()
+                if not errno:
+                    self.game_over(f'It\'s a {result}!')
+
                 print(f"Received invalid coords, error: {errno}")
                 exit(-1)
 
-            enemy_coords, errno = gameClient.recv_enemy_coords()
-            gameClient.sock.sendall(str.encode(str(errno)))
             if errno:
-                print("Received invalid enemy coords")
-                exit(-1)
+                gameClient.report_error(errno)
 
-            target_coord, errno = gameClient.recv_target_coord()
-            gameClient.sock.sendall(str.encode(str(errno)))
-            if errno:
-                print("Received invalid target coord")
-                exit(-1)
+            now = time.monotonic()
+            my_coords = gameClient.predicted_snake_coords(now)
+            enemy_coords = gameClient.interpolated_enemy_snakes_coords(now)
+
+            # redraw only when something moved
+            frame = (gameClient.tick, my_coords[0] if len(my_coords) else None,
+                     tuple(coords[0] for coords in enemy_coords.values()))
+            if frame == drawn_frame:
+                continue
+            drawn_frame = frame
 
             for _snake in snakes: self.plane.erase_snake(_snake)
             self.plane.erase_target(self.target)
-            self.screen.refresh()
 
-            self.target.coords = target_coord
-            enemy_snake.set_coords(enemy_coords)
+            self.target.coords = gameClient.target_coord
+            self.update_enemy_snakes(enemy_snakes, enemy_coords)
             self.snake.set_coords(my_coords)
+            snakes = [self.snake] + list(enemy_snakes.values())
 
-            self.screen.refresh()
             for _snake in snakes: self.plane.draw_snake(_snake)
             self.plane.draw_target(self.target)
 
             # update score if snake ate target
-            if self.target.coords.same(self.snake.coords[0]):
-                self.score.increment()
+            if gameClient.my_score() != self.score.points:
+                self.score.points = gameClient.my_score()
                 self.plane.draw_score(self.score)
 
             self.screen.refresh()
 
-
         self.game_over()
 
 
@@ -562,7 +603,6 @@ class Menu:
         self.selected_choice = 0
 
         self.done = False
-        self.key_listener = keyboard.Listener(on_press=self.on_press)
 
         self.update_misc()
 
@@ -570,10 +610,28 @@ class Menu:
         self.choices = [self.sp_choice, self.mp_choice, self.qg_choice]
 
     def show_menu(self):
-        self.key_listener.start()
-        time.sleep(1)
+        # keys are read blocking, the menu is drawn again only after one
+        curses.cbreak()
+        curses.noecho()
+        self.screen.nodelay(False)
+        self.screen.keypad(True)
+
+        self.draw_bounds()
+        self.draw_choices()
+
+        while not self.done:
+            key = self.screen.getch()
+            if key == curses.KEY_RESIZE:
+                self.rows, self.cols = self.screen.getmaxyx()
+                self.draw_bounds()
+            else:
+                self.on_key(key)
+            self.draw_choices()
+
+        return self.selected_choice
+
+    def draw_bounds(self):
         # clear screen
-        self.screen.refresh()
         self.screen.clear()
 
         # draw top-bottom bounds
@@ -585,22 +643,19 @@ class Menu:
             self.screen.addstr(i+1, 0, "|", curses.color_pair(COLOR_GREEN))
             self.screen.addstr(i+1, self.cols - 2, "|", curses.color_pair(COLOR_GREEN))
 
+    def draw_choices(self):
         y_menu = int(self.rows / 3)
         x_menu = int(self.cols / 2.4)
 
-        while True:
-            if self.done:
-                return self.selected_choice
-
-            self.screen.addstr(y_menu, x_menu , ' '*(len(self.sp_choice) + 2), curses.color_pair(COLOR_YELLOW))
-            self.screen.addstr(y_menu + 4, x_menu, ' '*(len(self.mp_choice) + 2), curses.color_pair(COLOR_YELLOW))
-            self.screen.addstr(y_menu + 8, x_menu, ' '*(len(self.qg_choice) + 2), curses.color_pair(COLOR_YELLOW))
+        self.screen.addstr(y_menu, x_menu , ' '*(len(self.sp_choice) + 2), curses.color_pair(COLOR_YELLOW))
+        self.screen.addstr(y_menu + 4, x_menu, ' '*(len(self.mp_choice) + 2), curses.color_pair(COLOR_YELLOW))
+        self.screen.addstr(y_menu + 8, x_menu, ' '*(len(self.qg_choice) + 2), curses.color_pair(COLOR_YELLOW))
 
-            self.screen.addstr(y_menu, x_menu , self.sp_choice, curses.color_pair(COLOR_YELLOW))
-            self.screen.addstr(y_menu + 4, x_menu, self.mp_choice, curses.color_pair(COLOR_YELLOW))
-            self.screen.addstr(y_menu + 8, x_menu, self.qg_choice, curses.color_pair(COLOR_YELLOW))
+        self.screen.addstr(y_menu, x_menu , self.sp_choice, curses.color_pair(COLOR_YELLOW))
+        self.screen.addstr(y_menu + 4, x_menu, self.mp_choice, curses.color_pair(COLOR_YELLOW))
+        self.screen.addstr(y_menu + 8, x_menu, self.qg_choice, curses.color_pair(COLOR_YELLOW))
 
-            self.screen.refresh()
+        self.screen.refresh()
 
     def update_choice(self):
 
@@ -615,31 +670,28 @@ class Menu:
         elif self.selected_choice == 2:
             self.qg_choice = "> " + Menu.QG_CHOICE
 
-    def on_press(self, key):
-        try:
-            if key==Key.up:
-                if self.selected_choice > 0:
-                    self.selected_choice -= 1
-                    self.update_choice()
-            elif key==Key.down:
-                if self.selected_choice < 2:
-                    self.selected_choice += 1
-                    self.update_choice()
-            elif key==Key.enter:
-                self.process_choice()
-            else:
-                pass
-        except AttributeError:
-            pass
+    def on_key(self, key):
+        '''key: curses key code'''
+        if key == curses.KEY_UP:
+            if self.selected_choice > 0:
+                self.selected_choice -= 1
+                self.update_choice()
+        elif key == curses.KEY_DOWN:
+            if self.selected_choice < 2:
+                self.selected_choice += 1
+                self.update_choice()
+        elif key in (curses.KEY_ENTER, ord('\n'), ord('\r')):
+            self.process_choice()
 
     def process_choice(self):
-        self.key_listener.stop()
         self.done = True
 
 
 def main():
     screen = curses.initscr()
     screen.scrollok(True)
+    # esc on its own, not the start of an arrow key, after that long
+    curses.set_escdelay(ESC_DELAY_MS)
     game = SnakeGame(screen)
     game.start()
 
@@ -1,8 +1,18 @@
+import select
 import socket
 import time
+from collections import deque
 import random as rd
 import curses
 from coord import Coord
+from snake_body import SnakeBody
+from prediction import Prediction
+import protocol
+from protocol import MsgType
+
+UDP_HELLO_REPEAT = 3
+KEYFRAME_RETRY = 5      # bad updates before asking for the keyframe again
+CLOCK_SAMPLES = 8       # clock sync round trips, the shortest one is kept
 
 class Client:
     def __init__(self, user, host, port):
@@ -11,18 +21,44 @@ class Client:
         self.port = port
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.decoder = protocol.FrameDecoder()
+
+        # frames put back for a later recv_frame
+        self.deferred = deque()
 
         self.ready = False
         self.game_height = 0
         self.game_width = 0
-        self.starting_time = 0
+        self.start_ns = 0           # monotonic_ns of the game start on my clock
 
+        # server monotonic_ns - mine and the round trip it was measured with, see sync_clock
+        self.clock_offset_ns = 0
+        self.clock_rtt_ns = None
+
+        # room state from the last applied snapshot
         self.target_coord = None
-        self.my_snake_coords = None
-        self.enemy_snake_coords = None
+        self.slot = 0           # slot of my snake
+        self.snakes = {}        # slot -> SnakeBody
+        self.scores = {}        # slot -> points
+        self.tick = -1          # nothing applied yet
+
+        # optional udp snapshot channel
+        self.udp_sock = None
+        self.moves_sent = 0     # also the sequence number of the last move
+        self.moves_acked = 0    # moves the server applied or dropped, reported in snapshots
+
+        # my snake drawn ahead of the snapshots, the others behind, see enable_prediction
+        self.prediction = None
+
+        # a bad update was reported, updates are skipped until a keyframe
+        self.awaiting_keyframe = False
+        self.bad_updates = 0
 
         self.valid_moves = Coord.DIRECTIONS      # up, down, left, right
 
+        # tcp and udp bytes received
+        self.bytes_received = 0
+
     def connect(self):
         try:
             self.sock.connect((self.host, self.port))
@@ -31,9 +67,63 @@ class Client:
 
         return True
 
+    def recv_frame(self):
+        '''blocks until a whole frame arrived
+            will return (msg_type, payload), msg_type is None if the connection closed
+        '''
+        if self.deferred:
+            return self.deferred.popleft()
+
+        while not self.decoder.has_frame():
+            try:
+                data = self.sock.recv(65536)
+                if len(data) == 0:
+                    return None, b''
+                self.bytes_received += len(data)
+                self.decoder.feed(data)
+            except (OSError, ValueError):
+                return None, b''
+
+        return self.decoder.pop()
+
+    def recv_reply(self):
+        '''will return the text of the server reply: OK, BUSY or the error message
+            game updates pushed before the reply are kept for later
+        '''
+        msg_type, payload = self.recv_frame()
+        skipped = []
+        while msg_type == MsgType.SNAPSHOT:
+            skipped.append((msg_type, payload))
+            msg_type, payload = self.recv_frame()
+        self.deferred.extend(skipped)
+
+        if msg_type == MsgType.OK:
+            return 'OK'
+        if msg_type == MsgType.BUSY:
+            return 'BUSY'
+        if msg_type == MsgType.ERROR:
+            return bytes.decode(payload, errors='replace')
+
+        return f'UNEXPECTED MESSAGE {msg_type}'
+
+    def send_ack(self, errno):
+        self.sock.sendall(protocol.encode_byte(MsgType.ACK, errno))
+
+    def report_error(self, errno):
+        '''reports a bad game update, the server answers with a keyframe
+            reported again every KEYFRAME_RETRY bad updates until the keyframe
+            arrives, in case it was lost on udp
+        '''
+        self.bad_updates += 1
+        if self.awaiting_keyframe and self.bad_updates % KEYFRAME_RETRY:
+            return
+
+        self.send_ack(errno)
+        self.awaiting_keyframe = True
+
     def identify_myself(self):
-        self.sock.sendall(str.encode(f"username:{self.user}"))
-        buf = bytes.decode(self.sock.recv(4069))
+        self.sock.sendall(protocol.encode_text(MsgType.USERNAME, self.user))
+        buf = self.recv_reply()
 
         if buf == 'OK':
             # server received username
@@ -47,8 +137,8 @@ class Client:
         return False
 
     def send_quit(self):
-        self.sock.sendall(str.encode("quitting"))
-        buf = bytes.decode(self.sock.recv(4069))
+        self.sock.sendall(protocol.encode(MsgType.QUITTING))
+        buf = self.recv_reply()
         if buf == 'OK':
             # server received quit message
             return True
@@ -60,188 +150,288 @@ class Client:
             print(f"The move: {move} is not valid")
             return False
 
-        self.sock.sendall(str.encode(f"my_move:{move}"))
-        buf = bytes.decode(self.sock.recv(4069))
-        if buf == 'OK':
-            # server received move
-            return True
-
-        print(f"Server did not like move {move}, error: {buf}")
-        return False
+        # not answered, the server applies at most one queued move per tick
+        self.sock.sendall(protocol.encode_byte(MsgType.MY_MOVE, self.valid_moves.index(move)))
+        self.moves_sent += 1
+        if self.prediction is not None:
+            self.prediction.sent(self.moves_sent, move, self.tick, time.monotonic())
+        return True
 
     def recv_starting_time(self):
-        '''will return (time, errno)'''
-        msg = bytes.decode(self.sock.recv(1024))
-        ln = len('time:')
+        '''will return (server monotonic ns of the start, errno)'''
+        msg_type, payload = self.recv_frame()
 
-        if msg[0:ln] != 'time:':
+        if msg_type != MsgType.START:
             return 0, 1
 
-        time_str = msg[ln:]
-        time_seconds = 0
-
-        try:
-            time_seconds = int(time_str)
-        except:
-            return 0, 2
+        return protocol.decode_clock_ns(payload)
 
-        return time_seconds, 0
+    def sync_clock(self, samples=CLOCK_SAMPLES):
+        '''measures the offset of the server's monotonic clock, NTP style
+            the server stamps every request, the stamp is taken as halfway
+            through the round trip, the shortest round trip is the most exact.
+            frames pushed meanwhile are kept for later
+            will return errno
+        '''
+        skipped = []
+        errno = 0
+
+        for _ in range(samples):
+            sent_ns = time.monotonic_ns()
+            self.sock.sendall(protocol.encode_clock_ns(MsgType.CLOCK, sent_ns))
+
+            msg_type, payload = self.recv_frame()
+            while msg_type is not None and msg_type != MsgType.CLOCK:
+                skipped.append((msg_type, payload))
+                msg_type, payload = self.recv_frame()
+            if msg_type is None:
+                skipped.append((msg_type, payload))
+                errno = 1
+                break
+
+            received_ns = time.monotonic_ns()
+            client_ns, server_ns, errno = protocol.decode_clock_reply(payload)
+            if errno or client_ns != sent_ns:
+                errno = errno or 2
+                break
+
+            rtt_ns = received_ns - sent_ns
+            if self.clock_rtt_ns is None or rtt_ns < self.clock_rtt_ns:
+                self.clock_rtt_ns = rtt_ns
+                self.clock_offset_ns = server_ns - (sent_ns + received_ns) // 2
+
+        self.deferred.extend(skipped)
+        return errno
 
     def recv_game_result(self):
         '''will return (status, errno)'''
-        valid_results = ['draw', 'win', 'loss']
-        msg = bytes.decode(self.sock.recv(1024))
-        ln = len('result:')
+        msg_type, payload = self.recv_frame()
 
-        if msg[0:ln] != 'result:':
+        if msg_type != MsgType.RESULT:
             return '', 1
 
-        result = msg[ln:]
-        if result not in valid_results:
+        result, errno = protocol.decode_byte(payload)
+        if errno or result >= len(protocol.RESULTS):
             return '', 2
 
-        return result, 0
-
-    def recv_target_coord(self):
-        '''will return ((x, y), errno)'''
-        msg = bytes.decode(self.sock.recv(1024))
-        ln = len('target_coord:')
-
-        if msg[0:ln] != 'target_coord:':
-            return (0, 0), 1
-
-        if (len(msg) < ln + 3) or (len(msg) > ln + 9):
-            return (0, 0), 2
+        return protocol.RESULTS[result], 0
 
-        comma_index = msg.find(',')
-        if comma_index not in [ln+1, ln+2, ln+3, ln+4]:
-            return (0, 0), 2
+    def recv_slot(self):
+        '''will return (slot, errno)'''
+        msg_type, payload = self.recv_frame()
 
-        x_str = msg[ln:comma_index]
-        y_str = msg[comma_index+1:]
-
-        x = 0
-        y = 0
-        try:
-            x = int(x_str)
-            y = int(y_str)
-        except:
-            return (0, 0), 2
-
-        return Coord(x, y), 0
-
-    def recv_my_coords(self):
-        '''will return list of coord tuples and errno'''
-        msg = bytes.decode(self.sock.recv(1024))
-        ln = len('your_coords:')
-
-        if msg[0:ln] != 'your_coords:':
-            return [], 1
+        if msg_type != MsgType.YOUR_SLOT:
+            return 0, 1
 
-        if (len(msg) < ln + 5):
-            return [], 2
+        return protocol.decode_byte(payload)
 
-        ''' split all coords into list of individual coord strings
-            in the format '(x,y'
+    def enable_udp(self, udp_addr=None):
+        '''asks the server to send snapshots over udp, everything else stays on tcp
+            udp_addr overrides the server's udp address, e.g. to go through udp_shim
+            will return False if the server does not offer udp
         '''
-        coord_list = msg[ln:-1].split(')')
-        received_coords = []
-
-        # append all received coords
-        for coord_string in coord_list:
-            comma_index = coord_string.find(',')
-            if comma_index not in [1, 2, 3, 4]:
-                return [], 2
-
-            x_str = coord_string[1:comma_index]
-            y_str = coord_string[comma_index+1:]
-
-            x = 0
-            y = 0
-            try:
-                x = int(x_str)
-                y = int(y_str)
-            except:
-                return [], 2
+        self.sock.sendall(protocol.encode(MsgType.USE_UDP))
+        msg_type, payload = self.recv_frame()
 
-            received_coords.append(Coord(x, y))
+        if msg_type != MsgType.UDP_TOKEN or len(payload) != protocol.UDP_TOKEN.size:
+            print(f"Server did not offer udp, error: {bytes.decode(payload, errors='replace')}")
+            return False
 
-        return received_coords, 0
+        token, udp_port = protocol.UDP_TOKEN.unpack(payload)
+        if udp_addr is None:
+            udp_addr = (self.host, udp_port)
 
-    def recv_enemy_coords(self):
-        '''will return list of coord tuples and errno'''
-        msg = bytes.decode(self.sock.recv(1024))
-        ln = len('enemy_coords:')
+        self.udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_sock.connect(udp_addr)
 
-        if msg[0:ln] != 'enemy_coords:':
-            return [], 1
+        # the server sends over tcp until one of them arrives
+        for _ in range(UDP_HELLO_REPEAT):
+            self.udp_sock.send(protocol.UDP_HELLO.pack(token))
 
-        if len(msg) < ln + 5:
-            return [], 2
+        return True
 
-        ''' split all coords into list of individual coord strings
-            in the format '(x,y'
+    def recv_snapshot(self):
+        '''applies the next snapshot to the snakes, scores, target and tick
+            snapshots come over udp if enabled, tcp is still watched for
+            keyframes and the game result
+            will return errno
         '''
-        coord_list = msg[ln:-1].split(')')
-        received_coords = []
-
-        # append all received coords
-        for coord_string in coord_list:
-            comma_index = coord_string.find(',')
-            if comma_index not in [1, 2, 3, 4]:
-                return [], 2
-
-            x_str = coord_string[1:comma_index]
-            y_str = coord_string[comma_index+1:]
+        while True:
+            tcp_ready = self.udp_sock is None or self.deferred or self.decoder.has_frame()
+            if not tcp_ready:
+                readable, _, _ = select.select([self.sock, self.udp_sock], [], [])
+                tcp_ready = self.sock in readable
+
+            if tcp_ready:
+                msg_type, payload = self.recv_frame()
+
+                if msg_type != MsgType.SNAPSHOT:
+                    # keep it for the caller, e.g. a game result
+                    self.deferred.appendleft((msg_type, payload))
+                    return 1
+
+                return self.apply_snapshot(payload)
+
+            datagram = self.udp_sock.recv(65536)
+            applied, errno = self.apply_datagram(datagram)
+            if errno or applied:
+                return errno
+
+    def poll_snapshots(self, timeout):
+        '''applies every snapshot that arrives within timeout seconds, 0 does not wait
+            will return errno, 1 if another frame is waiting, e.g. the game result
+        '''
+        deadline = time.monotonic() + timeout
+        socks = [self.sock] if self.udp_sock is None else [self.sock, self.udp_sock]
+
+        while True:
+            while self.deferred or self.decoder.has_frame():
+                msg_type, payload = self.recv_frame()
+                if msg_type != MsgType.SNAPSHOT:
+                    self.deferred.appendleft((msg_type, payload))
+                    return 1
+
+                errno = self.apply_snapshot(payload)
+                if errno:
+                    return errno
+
+            readable, _, _ = select.select(socks, [], [], max(deadline - time.monotonic(), 0))
+            if not readable:
+                return 0
+
+            if self.sock in readable:
+                try:
+                    data = self.sock.recv(65536)
+                except OSError:
+                    data = b''
+                if len(data) == 0:
+                    self.deferred.appendleft((None, b''))
+                    return 1
+                self.bytes_received += len(data)
+                try:
+                    self.decoder.feed(data)
+                except ValueError:
+                    self.deferred.appendleft((None, b''))
+                    return 1
+
+            if self.udp_sock is not None and self.udp_sock in readable:
+                _, errno = self.apply_datagram(self.udp_sock.recv(65536))
+                if errno:
+                    return errno
+
+    def apply_datagram(self, datagram):
+        '''will return (number of snapshots applied, errno)'''
+        self.bytes_received += len(datagram)
+
+        moves_applied, payloads, errno = protocol.decode_datagram(datagram)
+        if errno:
+            return 0, errno
+        self.moves_acked = max(self.moves_acked, moves_applied)
 
-            x = 0
-            y = 0
-            try:
-                x = int(x_str)
-                y = int(y_str)
-            except:
-                return [], 2
+        # the datagram repeats older deltas, apply the ones not seen yet
+        fresh = [payload for payload in payloads if protocol.snapshot_tick(payload) > self.tick]
+        for payload in fresh:
+            errno = self.apply_snapshot(payload)
+            if errno:
+                return 0, errno
 
-            received_coords.append(Coord(x, y))
+        return len(fresh), 0
 
-        return received_coords, 0
+    def apply_snapshot(self, payload):
+        '''will return errno'''
+        tick, flags, target, snakes, errno = protocol.decode_snapshot(payload)
+        if errno:
+            return errno
+
+        if tick <= self.tick:
+            # late duplicate
+            return 0
+
+        popped = {}     # slot -> tail the delta took off
+        if flags & protocol.FLAG_KEYFRAME:
+            self.snakes = {slot: SnakeBody(coords) for slot, _, _, _, coords in snakes}
+            self.awaiting_keyframe = False
+            self.bad_updates = 0
+        else:
+            # a delta only applies on top of the previous snapshot
+            if tick != self.tick + 1:
+                return 2
+            for slot, _, _, _, coords in snakes:
+                if len(coords) != 1 or len(self.snakes.get(slot, [])) == 0:
+                    return 2
+
+            for slot, snake_flags, _, _, coords in snakes:
+                body = self.snakes[slot]
+                body.push_head(coords[0])
+                if not snake_flags & protocol.FLAG_GROW:
+                    popped[slot] = body.pop_tail()
+
+            # snakes missing from the snapshot died or left
+            for slot in set(self.snakes) - {slot for slot, _, _, _, _ in snakes}:
+                del self.snakes[slot]
+
+        self.scores = {slot: score for slot, _, score, _, _ in snakes}
+        if target is not None:
+            self.target_coord = target
+        self.tick = tick
+
+        for slot, _, _, moves_applied, _ in snakes:
+            if slot == self.slot:
+                self.moves_acked = max(self.moves_acked, moves_applied)
+        if self.prediction is not None:
+            self.prediction.on_snapshot(tick, self.moves_acked, self.enemy_snakes_coords, popped, time.monotonic())
+
+        return 0
+
+    def enable_prediction(self):
+        self.prediction = Prediction()
+
+    def in_bounds(self, coord):
+        '''inside the walls of the room, x <= 0, x >= width, y <= 1 and y >= height are walls'''
+        return 0 < coord.x < self.game_width and 1 < coord.y < self.game_height
+
+    def predicted_snake_coords(self, now):
+        '''my snake where the server will have it when my next move arrives'''
+        body = self.snakes.get(self.slot)
+        if self.prediction is None or not body:
+            return self.my_snake_coords
+        return self.prediction.my_snake(body, self.tick, now, self.in_bounds)
+
+    def interpolated_enemy_snakes_coords(self, now):
+        '''slot -> coords of the other snakes, a steady tick behind the snapshots'''
+        if self.prediction is None:
+            return self.enemy_snakes_coords
+        return self.prediction.other_snakes(now)
+
+    @property
+    def my_snake_coords(self):
+        return self.snakes.get(self.slot, [])
+
+    @property
+    def enemy_snakes_coords(self):
+        '''slot -> coords of every other snake still in the match'''
+        return {slot: coords for slot, coords in self.snakes.items() if slot != self.slot}
+
+    def my_score(self):
+        return self.scores.get(self.slot, 0)
 
     def recv_shared_screen_size(self):
         '''will return (height, width, errno)'''
-        msg = bytes.decode(self.sock.recv(1024))
-        ln = len('shared_screen_size:')
-
-        if len(msg) < (ln + 5):
-            return 0, 0, 1
+        msg_type, payload = self.recv_frame()
 
-        if msg[0:ln] != 'shared_screen_size:':
+        if msg_type != MsgType.SHARED_SCREEN_SIZE:
             return 0, 0, 1
 
-        if len(msg) > (ln + 9):
-            return 0, 0, 2
-
-        x_index = msg.find('x')
-        if (x_index < 0) or (x_index not in [ln+2, ln+3, ln+4]):
-            return 0, 0, 2
-
-        height_string = msg[ln:x_index]
-        width_string = msg[x_index+1:]
-
-        height = 0
-        width = 0
-        try:
-            height = int(height_string)
-            width = int(width_string)
-        except:
-            return 0, 0, 2
-
-        return height, width, 0
+        return protocol.decode_screen_size(payload)
 
     def identify_screensize(self):
         screen = curses.initscr()
         height, width = screen.getmaxyx()
-        self.sock.sendall(str.encode(f"screen_size:{height}x{width}"))
-        buf = bytes.decode(self.sock.recv(4069))
+        return self.send_screensize(height, width)
+
+    def send_screensize(self, height, width):
+        self.sock.sendall(protocol.encode_screen_size(MsgType.SCREEN_SIZE, height, width))
+        buf = self.recv_reply()
 
         if buf == 'OK':
             # server received Screen-Size
@@ -257,37 +447,34 @@ class Client:
             exit(-1)
 
         height, width, errno = self.recv_shared_screen_size()
-        self.sock.sendall(str.encode(str(errno)))
+        self.send_ack(errno)
         if errno:
             print("Received invalid shared screen-size")
             exit(-1)
         self.game_height = height
         self.game_width = width
 
-        my_coords, errno = self.recv_my_coords()
-        self.sock.sendall(str.encode(str(errno)))
+        slot, errno = self.recv_slot()
+        self.send_ack(errno)
         if errno:
-            print("Received invalid coords")
+            print("Received invalid slot")
             exit(-1)
-        self.my_snake_coords = my_coords.copy()
+        self.slot = slot
 
-        enemy_coords, errno = self.recv_enemy_coords()
-        self.sock.sendall(str.encode(str(errno)))
+        errno = self.recv_snapshot()
+        self.send_ack(errno)
         if errno:
-            print("Received invalid enemy coords")
+            print("Received invalid coords")
             exit(-1)
-        self.enemy_snake_coords = enemy_coords.copy()
 
-        target_coord, errno = self.recv_target_coord()
-        self.sock.sendall(str.encode(str(errno)))
-        if errno:
-            print("Received invalid target coord")
+        # the start is sent on the server's clock
+        if self.sync_clock():
+            print("Could not sync the clock with the server")
             exit(-1)
-        self.target_coord = target_coord
 
-        time_seconds, errno = self.recv_starting_time()
-        self.sock.sendall(str.encode(str(errno)))
+        start_ns, errno = self.recv_starting_time()
+        self.send_ack(errno)
         if errno:
             print(f"Received invalid time {errno}")
             exit(-1)
-        self.starting_time = time_seconds
+        self.start_ns = start_ns - self.clock_offset_ns
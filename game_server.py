@@ -1,12 +1,40 @@
+import asyncio
+import collections
+import itertools
+import json
+import os
 import socket
 import time
 from enum import Enum
 import random as rd
 from coord import Coord
-
-
-INITIAL_SNAKE_LENGTH = 6
-INITIAL_SNAKE_DIRECTION = 'right'
+from engine import Event, INITIAL_SNAKE_LENGTH, OPPOSITE, match_results
+from replay import MatchLog
+import protocol
+from scheduler import TickScheduler
+from protocol import MsgType
+
+
+TICK_MS = 100               # default tick period of a match
+START_DELAY_SECONDS = 6     # from the end of the setup to the first move
+KEYFRAME_INTERVAL = 50      # ticks between full snake updates
+UDP_REDUNDANCY = 3          # delta snapshots repeated in every udp datagram
+MAX_DATAGRAM_SIZE = 65000   # bigger snapshots go over tcp
+PLAYERS_PER_ROOM = 2        # default, up to MAX_PLAYERS_PER_ROOM
+MAX_PLAYERS_PER_ROOM = 32
+MOVE_QUEUE_SIZE = 4         # moves waiting for a tick, older ones are dropped
+MOVES_PER_SECOND = 20       # sustained move rate of a player, faster moves are dropped
+MOVE_BURST = 5
+MAX_WRITE_BUFFER = 1 << 20  # bytes waiting for a client before it is disconnected
+ACK_TIMEOUT_SECONDS = 10    # for all the players asked to ack a message
+EARLY_HELLOS = 1024         # udp hellos kept for players the launcher has not handed over yet
+
+def get_my_ip():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.connect(('8.8.8.8', 80))
+    ip = s.getsockname()[0]
+    s.close()
+    return ip
 
 class PlayerStatus(Enum):
     READY = 0
@@ -14,28 +42,89 @@ class PlayerStatus(Enum):
     WAITING_FOR_SCREEN_SIZE = 2
 
 class Player:
-    def __init__(self, sock, addr, id):
-        self.sock = sock
-        self.addr = addr
+    def __init__(self, reader, writer, id):
+        self.reader = reader
+        self.writer = writer
+        self.addr = writer.get_extra_info('peername')
         self.id = id
+        self.room = None
         self.screen_height = 0
         self.screen_width = 0
 
-        self.snake_coords = []  # list of Coord Objects
-        self.snake_length = INITIAL_SNAKE_LENGTH
-        self.snake_direction = INITIAL_SNAKE_DIRECTION
+        self.snake = None   # engine.SnakeState, set when the room starts
+        self.slot = 0       # index of the snake in the room's snapshots
+        self.needs_keyframe = False     # client reported a bad update
+
+        # moves wait here for the ticks, one is taken per tick
+        self.moves = collections.deque(maxlen=MOVE_QUEUE_SIZE)    # (sequence number, direction)
+        self.moves_received = 0     # MY_MOVEs so far, the sequence number of the last one
+        self.moves_dropped = 0      # over the rate, the queue size or invalid
+        self.move_tokens = MOVE_BURST
+        self.move_tokens_at = time.monotonic()
+
+        # optional udp snapshot channel, set once the client's hello arrived
+        self.udp_token = None
+        self.udp_addr = None
+
+        # in-game frames: acks and commands (MY_MOVE, QUITTING)
+        # None is queued on both when the connection closes
+        self.acks = asyncio.Queue()
+        self.commands = asyncio.Queue()
+
+    def send(self, msg):
+        '''a client that stops reading is dropped once MAX_WRITE_BUFFER bytes wait for it'''
+        if self.writer.is_closing():
+            return
+
+        self.writer.write(msg)
+        if self.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+            print(f"Player {self.id} does not read, disconnecting")
+            # the reader sees the connection close and the room drops the player
+            self.writer.transport.abort()
+
+    def close(self):
+        self.writer.close()
+
+    def closed(self):
+        self.acks.put_nowait(None)
+        self.commands.put_nowait(None)
+
+    def queue_move(self, move_index):
+        '''queues a move unless it is invalid or over the rate limit, no reply is sent
+            move_index: None for a payload that did not decode
+        '''
+        self.moves_received += 1
+
+        # token bucket: MOVES_PER_SECOND, with bursts of MOVE_BURST
+        now = time.monotonic()
+        self.move_tokens = min(MOVE_BURST, self.move_tokens + (now - self.move_tokens_at) * MOVES_PER_SECOND)
+        self.move_tokens_at = now
+
+        if self.move_tokens < 1 or move_index is None or move_index >= len(Coord.DIRECTIONS):
+            self.moves_dropped += 1
+            return
 
+        self.move_tokens -= 1
+        if len(self.moves) == self.moves.maxlen:
+            self.moves_dropped += 1
+        self.moves.append((self.moves_received, Coord.DIRECTIONS[move_index]))
 
-    def init_coords(self, head_coords):
-        self.snake_coords.append(head_coords)
-        hx, hy = head_coords.coords()
+    def next_move(self):
+        '''will return the first queued move that turns the snake, or None
+            moves along or against its direction are taken off without effect
+        '''
+        while self.moves:
+            _, move = self.moves.popleft()
+            if move != self.snake.direction and move != OPPOSITE[self.snake.direction]:
+                return move
 
-        # append rest of the body
-        for i in range(INITIAL_SNAKE_LENGTH - 1):
-            self.snake_coords.append(Coord(hx - i - 1, hy))
+        return None
 
-    def head_coords(self):
-        return self.snake_coords[0]
+    def moves_applied(self):
+        '''sequence number up to which every move was applied or dropped, for the client's prediction'''
+        if self.moves:
+            return self.moves[0][0] - 1
+        return self.moves_received
 
     def width(self):
         return self.screen_width
@@ -43,36 +132,6 @@ class Player:
     def height(self):
         return self.screen_height
 
-    def overlaps(self, coord):
-        for c in self.snake_coords:
-            if c == coord:
-                return True
-        return False
-
-    def snake_grow(self):
-        self.snake_length += 1
-        self.snake_coords.append(Coord(self.snake_coords[-1].x, self.snake_coords[-1].y))
-
-    def snake_hits_something(self, enemy, width, height):
-        # check if snake hits itself
-        head = self.snake_coords[0]
-        for i in range(1, self.snake_length):
-            body_cd = self.snake_coords[i]
-            if head.same(body_cd):
-                return True
-
-        # check if snake hits enemy
-        if enemy.overlaps(head):
-            return True
-
-        # check if snake hits bounds
-        if head.x <= 0 or head.x >= width:
-            return True
-        if head.y <= 1 or head.y >= height:
-            return True
-
-        return False
-
     def setScreenSize(self, height, width):
         self.screen_height = height
         self.screen_width = width
@@ -86,143 +145,78 @@ class Player:
 
         return PlayerStatus.READY
 
-    def move_snake(self):
-        pos = Coord.DIRECTIONS.index(self.snake_direction)
-        hx = self.snake_coords[0].x + Coord.DIRECTIONS_MOVES[pos][0]
-        hy = self.snake_coords[0].y + Coord.DIRECTIONS_MOVES[pos][1]
-
-        # body chain follow
-        tmp = Coord(self.head_coords().x, self.head_coords().y)
-
-        for i in range(1, self.snake_length):
-            tmp2 = Coord(self.snake_coords[i].x, self.snake_coords[i].y)
-            self.snake_coords[i].set_xy(tmp)
-            tmp.set_xy(tmp2)
-
-        # set new head position
-        self.snake_coords[0].x = hx
-        self.snake_coords[0].y = hy
-
     @staticmethod
-    def is_screen_size_valid(msg):
+    def is_screen_size_valid(msg_type, payload):
         '''will return (height, width, errno)'''
-
-        ln = len('screen_size:')
-        print("Screen_Size Identification Phrase: " + msg)
-        if len(msg) < (ln + 5):
-            return 0, 0, 1
-
-        if msg[0:ln] != 'screen_size:':
+        if msg_type != MsgType.SCREEN_SIZE:
             return 0, 0, 1
 
-        x_index = msg.find('x')
-        if (x_index < 0) or (x_index not in [ln+2, ln+3, ln+4]):
-            return 0, 0, 2
-
-        if len(msg) > (ln + 9):
-            return 0, 0, 2
-
-        height_string = msg[ln:x_index]
-        width_string = msg[x_index+1:]
-
-        height = 0
-        width = 0
-        try:
-            height = int(height_string)
-            width = int(width_string)
-        except:
-            return 0, 0, 2
+        height, width, errno = protocol.decode_screen_size(payload)
+        print(f"Screen_Size Identification: {height}x{width}")
+        return height, width, errno
 
-        return height, width, 0
 
+class Room:
+    '''one match: its players, board size, target and tick state'''
 
-class Server:
+    def __init__(self, server, id, players, tick_ms=TICK_MS, seed=None):
+        self.server = server
+        self.id = id
+        self.task = None
+        self.scheduler = TickScheduler(tick_ms)
 
-    def __init__(self, host, port):
-        self.host = host
-        self.port = port
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.players = []
+        # every random choice of the match comes from this seed, see replay.py
+        self.seed = seed if seed is not None else rd.getrandbits(32)
+        self.log = None             # MatchLog, set by generate_starting_coords
 
         # In Game properties
         self.game_started = False
         self.game_height = 0
         self.game_width = 0
-        self.ready_list = []
-        self.starting_time = 0
-        self.last_message_time = 0
-        self.target_coord = None
+        self.ready_list = players    # list of Player objects in the game
+        self.slots = list(players)      # every player of the match by slot
+        self.start_ns = 0               # monotonic_ns of the start, sent to the clients
+        self.engine = None          # board, snakes and target, set by generate_starting_coords
+        self.inputs = {}            # slot -> direction of the tick being played
+        self.tick = 0               # sequence number of the last snapshot
+        self.recent_deltas = collections.deque(maxlen=UDP_REDUNDANCY)
 
-        self.initial_snake_length = INITIAL_SNAKE_LENGTH
-        self.initial_snake_direction = INITIAL_SNAKE_DIRECTION
+        # set whenever a player of the room sends a command
+        self.input_event = asyncio.Event()
 
-        self.set_my_ip()
-        print(f"Server ip: {self.host}")
-
-    def set_my_ip(self):
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(('8.8.8.8', 80))
-        self.host = s.getsockname()[0]
-        s.close()
-
-    def is_username_valid(self, msg):
-        '''will return the parsed (username, errno)'''
-        ln = len('username:')
-        print("Indetification Phrase: " + msg)
-        if len(msg) < (ln + 1):
-            return '', 1
-
-        if msg[0:ln] != 'username:':
-            return '', 1
-
-        new_id = msg[ln:]
-        for p in self.players:
-            if p.id == new_id:
-                return '', 2
-
-        return new_id, 0
-
-    def game_ready(self):
-        return (len(self.ready_list) > 0)
+        for slot, p in enumerate(self.ready_list):
+            p.room = self
+            p.slot = slot
 
     def start_game(self):
         self.game_started = True
 
     def relocate_target(self):
-        c_players = [self.players[i] for i in self.ready_list]
-        _is_target_overlapping = True
-
-        while _is_target_overlapping:
-            self.target_coord = Coord.from_rand((3, self.game_width-3), (3, self.game_height-3))
-            _is_target_overlapping = False
-            for p in c_players:
-                if p.overlaps(self.target_coord):
-                    _is_target_overlapping = True
-                    break
-
-    def generate_starting_coords(self):
-        # initialize snake head coords at different rows with room for bounds
-        y_coords = []
-        hy = rd.randint(3, self.game_height-3)
+        '''moves the target to a random free cell
+            returns False if no cell is free, the target is then removed
+        '''
+        if not self.engine.relocate_target():
+            print(f"Board of room {self.id} is full")
+            return False
 
-        for i in self.ready_list:
-            p = self.players[i]
-            hx = rd.randint(self.initial_snake_length+3, self.game_width-3-INITIAL_SNAKE_LENGTH)
+        return True
 
-            while hy in y_coords:
-                hy = rd.randint(3, self.game_height-3)
-            y_coords.append(hy)
+    def generate_starting_coords(self):
+        # bounds are x <= 0, x >= width, y <= 1, y >= height, targets keep off them by 3
+        self.log = MatchLog(self.seed, self.game_width, self.game_height, (0, 1, self.game_width, self.game_height),
+                            ((3, self.game_width-3), (3, self.game_height-3)), len(self.ready_list), INITIAL_SNAKE_LENGTH)
 
-            p.init_coords(Coord(hx, hy))
+        # initialize snake head coords at different rows with room for bounds
+        self.engine = self.log.make_engine()
+        for p in self.ready_list:
+            p.snake = self.engine.snakes[p.slot]
 
     def set_game_screen_size(self):
         '''sets self.game_height, self.game_width to MIN({player sizes})'''
-        self.game_height = self.players[self.ready_list[0]].height()
-        self.game_width  = self.players[self.ready_list[0]].width()
-
-        for i in self.ready_list:
-            p = self.players[i]
+        self.game_height = self.ready_list[0].height()
+        self.game_width  = self.ready_list[0].width()
 
+        for p in self.ready_list:
             c_width = p.width()
             c_height = p.height()
 
@@ -232,367 +226,628 @@ class Server:
             if c_height < self.game_height:
                 self.game_height = c_height
 
-    def do_we_have_enough_players(self):
-        '''returns a list of indices (self.players) to participate in the game
-            returns empty list [] otherwise
-        '''
-        self.ready_list = [i for i in range(0, len(self.players)) if (self.players[i].status() == PlayerStatus.READY)]
-
-        if len(self.ready_list) < 2:
-            self.ready_list = []
+    def send_result(self, p, result):
+        p.send(protocol.encode_byte(MsgType.RESULT, protocol.RESULTS.index(result)))
+        print(f"Sent {result} to Player {p.id}")
 
+    def eliminate(self, p):
+        '''p is out of a match that goes on without it, after its result or quit reply was sent
+            its connection and username are freed at once
+        '''
+        self.ready_list.remove(p)
+        p.moves.clear()
+        p.room = None
+        self.server.remove_player(p)
 
     def send_to_ready_players(self, msg):
         '''sends msg to all players in ready_list'''
-        for i in self.ready_list:
-            p = self.players[i]
-            p.sock.sendall(msg)
+        for p in self.ready_list:
+            p.send(msg)
 
-            print(f"Sent: {bytes.decode(msg)} to Player {i}")
+            print(f"Sent: {MsgType(msg[protocol.HEADER.size - 1]).name} to Player {p.id}")
 
-    def get_responses_from_players_in_list(self, p_list=[]):
-        '''checks for a response from some or all players in ready_list
+    async def get_responses_from_players_in_list(self, p_list=[]):
+        '''waits for a response from some or all players in ready_list
             returns 0 for success
-            returns errno or -1 for disconnection
+            returns errno or -1 for disconnection or no answer within ACK_TIMEOUT_SECONDS
         '''
         if p_list == []:
             p_list = self.ready_list
 
-        not_done_list = p_list.copy()
-        while True:
-            for i in not_done_list:
-                p = self.players[i]
-                try:
-                    response = bytes.decode(p.sock.recv(1))
-                except:
-                    pass
-                else:
-                    if len(response) == 0:
-                        # conn closed - drop player
-                        self.players.pop(i)
-                        print(f"removed player {p.addr}")
-                        self.ready_list = []
-                        return -1
-                    if int(response):
-                        print(f"Client received bad message, error {response}")
-                        self.ready_list = []
-                        return int(response)
-
-                    print(f"Received 0 from Player {i}")
-                    not_done_list.remove(i)
-
-                    if len(not_done_list) < 1:
-                        return 0
+        deadline = time.monotonic() + ACK_TIMEOUT_SECONDS
+        for p in p_list.copy():
+            try:
+                response = await asyncio.wait_for(p.acks.get(), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                print(f"Player {p.id} did not answer in {ACK_TIMEOUT_SECONDS} s")
+                return -1
+            if response is None:
+                # conn closed
+                print(f"removed player {p.addr}")
+                return -1
+            if response:
+                print(f"Client received bad message, error {response}")
+                return response
+
+            print(f"Received 0 from Player {p.id}")
         return 0
 
+    def dispatch_game_message(self, p, msg_type, payload):
+        '''queues an in-game frame as an ack or a command'''
+        if msg_type == MsgType.ACK:
+            errno, error = protocol.decode_byte(payload)
+            errno = errno if not error else error
 
-    def start(self):
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind((self.host, self.port))
-        self.sock.setblocking(False)
-        self.sock.listen()
+            if self.game_started and errno:
+                # ticks are not acked, an error asks for a fresh keyframe
+                print(f"Player {p.id} reported bad update, error {errno}")
+                p.needs_keyframe = True
+                return
 
-        while True:
-            if self.game_ready():
+            p.acks.put_nowait(errno)
+            return
 
-                if not self.game_started:
-                    current_time_seconds = int(time.strftime("%S"))
-                    if current_time_seconds == self.starting_time:
-                        self.start_game()
-                        print("Starting Game!")
+        if msg_type == MsgType.MY_MOVE:
+            # no reply and no wake up, the next tick takes it
+            move_index, error = protocol.decode_byte(payload)
+            p.queue_move(None if error else move_index)
+            return
 
-                if self.game_started:
-                    if not self.communicate():
-                        # game over -- disconnect players
-                        self.ready_list.sort(reverse=True)
-                        for j in self.ready_list:
-                            self.players.pop(j)
+        p.commands.put_nowait((msg_type, payload))
+        self.input_event.set()
 
-                        self.ready_list = []
-                        print(f"removed players")
+    def player_closed(self, p):
+        p.closed()
+        self.input_event.set()
 
-            try:
-                conn, addr = self.sock.accept()
-                player = Player(conn, addr, "")
-                self.players.append(player)
-                print(f"Connected by {addr}")
-            except:
-                pass
-
-            i = 0
-            while i < len(self.players):
-                # do not try to reconnect to player already matched to a game
-                if self.game_ready():
-                    if i in self.ready_list:
-                        i = i + 1
-                        continue
-
-                p = self.players[i]
-                player_status = p.status()
-
-                try:
-                    buf = bytes.decode(p.sock.recv(1024))
-                except socket.error:
-                    pass
-                else:
-                    if len(buf) == 0:
-                        # conn closed - drop player
-                        self.players.pop(i)
-                        print(f"removed player {p.addr}")
-                        continue
-
-
-                    if player_status == PlayerStatus.WAITING_FOR_USERNAME:
-                        # we expect username:%username%
-                        if self.game_ready():
-                            p.sock.sendall(str.encode('BUSY'))
-                            i = i + 1
-                            continue
-
-                        username, error = self.is_username_valid(buf)
-
-                        if error == 1:
-                            p.sock.send(str.encode('INVALID ID PHRASE'))
-                            self.players.pop(i)
-                            print(f"removed player {p.addr}")
-
-                        if error == 2:
-                            # client should prompt user to choose a differ username
-                            p.sock.send(str.encode('ID UNAVAILABLE'))
-                            i = i + 1
-                            continue
-
-                        self.players[i].id = username
-                        print(f"Player {i} @user: {username}")
-                        p.sock.sendall(str.encode('OK'))
-
-                    elif player_status == PlayerStatus.WAITING_FOR_SCREEN_SIZE:
-                        # handle screen_size:<height>x<width>
-                        # we expect username:%username%
-                        if self.game_ready():
-                            p.sock.sendall(str.encode('BUSY'))
-                            i = i + 1
-                            continue
-
-                        height, width, error = Player.is_screen_size_valid(buf)
-
-                        if error == 1:
-                            p.sock.send(str.encode('INVALID SCREEN-SIZE PHRASE'))
-                            i = i + 1
-                            continue
-
-                        if error == 2:
-                            p.sock.send(str.encode('INVALID SCREEN_SIZE'))
-                            i = i + 1
-                            continue
-
-                        self.players[i].setScreenSize(height, width)
-                        print(f"Player {i} @ScreenSize: {height}x{width}")
-                        p.sock.sendall(str.encode('OK'))
-
-                    elif player_status == PlayerStatus.READY:
+    async def run_game(self):
+        '''room task: sets the game up, waits for the start and runs the ticks'''
+        try:
+            if not await self.prepare_game():
+                return
+
+            await self.wait_for_starting_time()
+            self.start_game()
+            print(f"Starting Game in room {self.id}!")
+
+            while await self.communicate():
+                # sleep until the next tick unless a player sends a command
+                timeout = self.scheduler.seconds_to_next_tick()
+                if timeout > 0:
+                    try:
+                        await asyncio.wait_for(self.input_event.wait(), timeout)
+                    except asyncio.TimeoutError:
                         pass
+        finally:
+            print(f"Room {self.id} tick stats: {self.scheduler.stats()}")
+            for p in self.slots:
+                if p.moves_dropped:
+                    print(f"Player {p.id} had {p.moves_dropped} moves dropped")
+            self.save_log()
+            self.server.close_room(self)
+
+    def save_log(self):
+        '''writes the match log to the server's replay_dir, if any'''
+        if self.server.replay_dir is None or self.log is None:
+            return
+
+        self.log.finish(self.engine)
+        path = os.path.join(self.server.replay_dir, f'match-{os.getpid()}-{self.id}-{self.seed}.json')
+        try:
+            self.log.save(path)
+            print(f"Saved match log {path}")
+        except OSError as e:
+            print(f"Could not save match log {path}: {e}")
+
+    async def prepare_game(self):
+        '''sends the game setup to the ready players
+            returns False if the game has to be discarded
+        '''
+        self.set_game_screen_size()
+        print(f"GAME STARTED in room {self.id}! (seed {self.seed})")
+        # send screen size to concerned players
+        msg = protocol.encode_screen_size(MsgType.SHARED_SCREEN_SIZE, self.game_height, self.game_width)
+        self.send_to_ready_players(msg)
 
-                if not self.game_ready():
-                    # check if we have enough players to start the game
-                    self.do_we_have_enough_players()
+        # discard the game if received error
+        if await self.get_responses_from_players_in_list() != 0:
+            return False
 
-                    if len(self.ready_list):
-                        self.set_game_screen_size()
-                        print('GAME STARTED!')
-                        # send screen size to concerned players
-                        msg = str.encode(f"shared_screen_size:{self.game_height}x{self.game_width}")
-                        self.send_to_ready_players(msg)
+        # tell players which snake of the snapshots is theirs
+        for p in self.ready_list:
+            p.send(protocol.encode_byte(MsgType.YOUR_SLOT, p.slot))
+            print(f"Sent slot {p.slot} to Player {p.id}")
 
-                        # discard the game if received error
-                        if self.get_responses_from_players_in_list() != 0:
-                            continue
+        if await self.get_responses_from_players_in_list() != 0:
+            return False
 
-                        self.generate_starting_coords()
-                        # send players their own coords
-                        for i in self.ready_list:
-                            p = self.players[i]
+        # position the snakes and the target within bounds and send them to players
+        try:
+            self.generate_starting_coords()
+        except ValueError as e:
+            print(f"Room {self.id} discarded: {e}")
+            return False
+        self.relocate_target()
+        self.send_to_ready_players(protocol.encode(MsgType.SNAPSHOT, self.pack_snapshot(keyframe=True)))
+
+        if await self.get_responses_from_players_in_list() != 0:
+            return False
+
+        print("All coords received successfully")
+
+        # the clients count down to the start on their clock, see Client.sync_clock
+        self.start_ns = time.monotonic_ns() + START_DELAY_SECONDS * 1_000_000_000
+        # send starting time to ready players
+        msg = protocol.encode_clock_ns(MsgType.START, self.start_ns)
+        self.send_to_ready_players(msg)
+        if await self.get_responses_from_players_in_list() != 0:
+            return False
 
-                            msg = "your_coords:"
-                            for c in p.snake_coords:
-                                msg += str(c.coords())
+        return True
 
-                            p.sock.sendall(str.encode(msg))
-                            print(f"Sent {msg} to Player {i}")
+    def pack_snapshot(self, keyframe):
+        '''the target is only included in keyframes or when it moved
+            snakes that died are left out, clients drop them
+        '''
+        snakes = [(s.slot, s.body, s.grew, s.score, self.slots[s.slot].moves_applied())
+                  for s in self.engine.snakes if s.alive]
+        target = self.engine.target if (keyframe or self.engine.target_moved) else None
 
-                        if self.get_responses_from_players_in_list() != 0:
-                            continue
+        return protocol.pack_snapshot(self.tick, snakes, target, keyframe)
 
-                        # send enemy coords (one enemy)
-                        for i in self.ready_list:
-                            p = self.players[i]
+    async def wait_for_starting_time(self):
+        # monotonic, so wall-clock adjustments do not move the start
+        delay = (self.start_ns - time.monotonic_ns()) / 1e9
+        if delay > 0:
+            await asyncio.sleep(delay)
 
-                            enemy_list = self.ready_list.copy()
-                            enemy_list.remove(i)
-                            for j in enemy_list:
-                                msg = "enemy_coords:"
-                                for c in self.players[j].snake_coords:
-                                    msg += str(c.coords())
+        self.scheduler.start(self.start_ns)
 
-                                p.sock.sendall(str.encode(msg))
-                                print(f"Sent {msg} to Player {j}")
+    async def communicate(self):
+        participating_players = self.ready_list.copy()
 
-                        if self.get_responses_from_players_in_list() != 0:
-                            continue
+        self.input_event.clear()
 
-                        # position the target within bounds and send the coord to players
-                        self.relocate_target()
-                        msg = str.encode(f"target_coord:{self.target_coord.x},{self.target_coord.y}")
-                        self.send_to_ready_players(msg)
+        for p in participating_players:
+            while not p.commands.empty():
+                command = p.commands.get_nowait()
 
-                        if self.get_responses_from_players_in_list() != 0:
-                            continue
+                if command is None:
+                    # conn closed - player quit
+                    if not await self.player_left(p):
+                        return False
+                    break
 
-                        print("All coords received successfully")
+                msg_type, payload = command
 
-                        current_time_seconds = int(time.strftime("%S"))
-                        self.starting_time = (current_time_seconds + 6)%59
-                        # send starting time to ready players
-                        msg = str.encode(f"time:{str(self.starting_time)}")
-                        self.send_to_ready_players(msg)
-                        if self.get_responses_from_players_in_list() != 0:
-                            continue
+                if msg_type == MsgType.QUITTING:
+                    print("Received quit message")
+                    p.send(protocol.encode(MsgType.OK))
+                    if not await self.player_left(p):
+                        return False
+                    break
 
-                        self.last_message_time = round(time.time() * 1000)
+                p.send(protocol.encode_text(MsgType.ERROR, f'COMMAND {msg_type} IS INVALID'))
 
-                i = i + 1
+        # advance the snakes once per due tick, catching up after a stall
+        for _ in range(self.scheduler.due_ticks()):
+            if not await self.step():
+                return False
 
-            time.sleep(0.02)
+        return True
 
-    def communicate(self):
-        valid_moves = ['up', 'down', 'left', 'right']
-        participating_players = [self.players[i] for i in self.ready_list]
+    async def player_left(self, p):
+        '''takes p out of the match
+            returns False if fewer than two players are left and the game is over
+        '''
+        self.eliminate(p)
+        print(f"Players left: {[e.id for e in self.ready_list]}")
 
+        if len(self.ready_list) >= 2:
+            # the others play on, the snake leaves the board
+            self.log.quit(self.engine.tick, p.slot)
+            self.engine.kill(p.slot)
+            return True
+
+        # notify the other player that enemy quit
+        msg = protocol.encode(MsgType.ENEMY_QUIT)
+        self.send_to_ready_players(msg)
+        await self.get_responses_from_players_in_list()
+        return False
 
+    async def step(self):
+        '''plays one tick: moves the snakes, resolves collisions, sends the updates'''
+        participating_players = self.ready_list.copy()
 
-        # if snake ate target, increment length & relocate target
+        # one queued move per player and tick
         for p in participating_players:
-            if p.overlaps(self.target_coord):
-                print(f"Player {p.id} ate target")
-                p.snake_grow()
-                self.relocate_target()
-                break
+            move = p.next_move()
+            if move is not None:
+                self.inputs[p.slot] = move
+
+        # eat, move and collide the snakes
+        self.log.record(self.engine.tick, self.inputs)
+        events = self.engine.step(self.inputs)
+        self.inputs = {}
+
+        dead = set()
+        for kind, slot in events:
+            if kind == Event.ATE:
+                print(f"Player {self.slots[slot].id} ate target")
+            elif kind == Event.BOARD_FULL:
+                print(f"Board of room {self.id} is full")
+            elif kind == Event.HEAD_ON or kind == Event.CRASHED:
+                print(f"Snake of Player {self.slots[slot].id} died ({kind.name})")
+                dead.add(slot)
+
+        # a result for every player the tick decided, the match ends with one snake left
+        results, game_over = match_results(self.engine.snakes, dead)
+        for p in participating_players:
+            if p.slot in results:
+                self.send_result(p, results[p.slot])
+                if not game_over:
+                    # acks of eliminated players are not awaited, the others play on
+                    self.eliminate(p)
+
+        if game_over:
+            await self.get_responses_from_players_in_list()
+            return False
+
+        participating_players = self.ready_list.copy()
+
+        # send only the new heads, with a full keyframe every KEYFRAME_INTERVAL ticks
+        self.tick += 1
+        room_keyframe = (self.tick % KEYFRAME_INTERVAL == 0)
+
+        # one snapshot per tick, encoded once and pushed to every player without waiting for acks
+        payloads = {False: self.pack_snapshot(False)}
+        frames = {}
+
+        # udp datagrams repeat the last deltas, so a lost datagram costs no state
+        self.recent_deltas.append(payloads[False])
+        udp_deltas = list(self.recent_deltas)
 
         for p in participating_players:
-            print(f"checking msg from player: {p.id}")
-            try:
-                buf = bytes.decode(p.sock.recv(1024))
-            except:
-                pass
-            else:
-                if len(buf) == 0:
-                    # conn closed - player quit
-                    p_ind = self.players.index(p)
-                    self.ready_list.remove(p_ind)
-                    # notify other player that enemy quit
-                    msg = str.encode("enemy_quit")
-                    print(f"Players left: {self.ready_list}")
-                    self.send_to_ready_players(msg)
-                    self.get_responses_from_players_in_list()
-                    self.ready_list.append(p_ind)
-                    return False
-
-
-                if buf[0:len('my_move:')] == 'my_move:':
-                    # extract new move
-                    new_move = buf[len('my_move:'):]
-                    if new_move not in valid_moves:
-                        # player sent an invalid move
-                        p.sock.sendall(str.encode('INVALID_MOVE'))
-                        continue
-                    # confirm reception of valid move
-                    p.sock.sendall(str.encode('OK'))
-                    print(f"received {new_move} from Player {p.id}")
-
-                    # change snake direction
-                    p.snake_direction = new_move
+            keyframe = room_keyframe or p.needs_keyframe
+            p.needs_keyframe = False
+
+            if keyframe not in payloads:
+                payloads[keyframe] = self.pack_snapshot(keyframe)
+
+            if p.udp_addr is not None:
+                datagram = protocol.encode_datagram(p.moves_applied(), [payloads[True]] if keyframe else udp_deltas)
+                if len(datagram) <= MAX_DATAGRAM_SIZE:
+                    self.server.send_datagram(p, datagram)
                     continue
 
-                if buf[0:len('quitting')] == 'quitting':
-                    print("Received quit message")
-                    p.sock.sendall(str.encode('OK'))
-                    # remove player
-                    self.ready_list.remove(self.players.index(p))
-                    # notify other player that enemy quit
-                    msg = str.encode("enemy_quit")
-                    self.send_to_ready_players(msg)
-                    self.get_responses_from_players_in_list()
-                    return False
-
-                p.sock.sendall(str.encode(f'COMMAND {buf} IS INVALID'))
-
-        current_time_ms = round(time.time() * 1000)
-
-        # send new move every 0.1 seconds
-        if current_time_ms - self.last_message_time >= 100:
-            for p in participating_players:
-                p.move_snake()
-
-            # check for collisions
-            for p in participating_players:
-                enemy_list = participating_players.copy()
-                enemy_list.remove(p)
-                for enemy in enemy_list:
-                    if p.head_coords() == enemy.head_coords():
-                        # head-head = draw
-                        print("It's a draw!")
-                        self.send_to_ready_players(str.encode("result:draw"))
-                        self.get_responses_from_players_in_list()
-                        return False
+            if keyframe not in frames:
+                frames[keyframe] = protocol.encode(MsgType.SNAPSHOT, payloads[keyframe])
 
-                    if p.snake_hits_something(enemy, self.game_width, self.game_height):
-                        # player p loses, enemy wins
-                        print("Snake collision")
-                        p.sock.sendall(str.encode("result:loss"))
-                        enemy.sock.sendall(str.encode("result:win"))
-                        self.get_responses_from_players_in_list()
-                        return False
+            p.send(frames[keyframe])
 
-            # send new snake coords to players
-            for p in participating_players:
-                msg = "your_coords:"
-                for c in p.snake_coords:
-                    msg += str(c.coords())
+        return True
 
-                p.sock.sendall(str.encode(msg))
-                print(f"Sent {msg} to Player {p.id}")
-            if self.get_responses_from_players_in_list() != 0:
-                return False
 
-            print("sent snakes their coords")
+class UdpEndpoint(asyncio.DatagramProtocol):
+    '''receives the clients' udp hellos for Server'''
 
-            # send enemy coords (one enemy)
-            for p in participating_players:
-                enemy_list = participating_players.copy()
-                enemy_list.remove(p)
-                for enemy in enemy_list:
-                    msg = "enemy_coords:"
-                    for c in enemy.snake_coords:
-                        msg += str(c.coords())
+    def __init__(self, server):
+        self.server = server
 
-                    p.sock.sendall(str.encode(msg))
-                    print(f"Sent {msg} to Player {enemy.id}")
-            if self.get_responses_from_players_in_list() != 0:
-                return False
+    def connection_made(self, transport):
+        self.server.udp_transport = transport
+
+    def datagram_received(self, data, addr):
+        self.server.udp_hello(data, addr)
+
+
+class Server:
+
+    def __init__(self, host, port, tick_ms=TICK_MS, replay_dir=None, players_per_room=PLAYERS_PER_ROOM):
+        self.host = host
+        self.port = port
+        self.tick_ms = tick_ms      # tick period of the rooms opened from now on
+        self.replay_dir = replay_dir    # rooms save their match log there if set
+        self.server = None
+        self.connections = set()    # every connected Player
+        self.players = {}           # username -> Player, once identified
+
+        # ready players waiting for a room, in arrival order (values unused)
+        self.lobby = {}
+
+        # running matches by room id
+        self.rooms = {}
+        self.room_ids = itertools.count()
+        if not 2 <= players_per_room <= MAX_PLAYERS_PER_ROOM:
+            raise ValueError(f"players per room must be in [2, {MAX_PLAYERS_PER_ROOM}]")
+        self.players_per_room = players_per_room
+
+        # optional udp snapshot channel
+        self.udp_port = None
+        self.udp_transport = None
+        self.udp_tokens = {}    # token -> Player
+
+        # worker mode: unix socket to the launcher, which runs the handshake
+        self.launcher = None
+        self.adopted = 0        # ready players handed over so far
+        self.early_hellos = {}  # token -> udp address, hellos that came before their player
+
+        # listen on this machine's ip unless told otherwise
+        if self.host is None:
+            self.set_my_ip()
+        print(f"Server ip: {self.host}")
+
+    def set_my_ip(self):
+        self.host = get_my_ip()
+
+    @staticmethod
+    def is_username_valid(msg_type, payload, taken):
+        '''will return the parsed (username, errno), taken holds the usernames in use'''
+        if msg_type != MsgType.USERNAME or len(payload) < 1:
+            return '', 1
+
+        try:
+            new_id = bytes.decode(payload)
+        except UnicodeDecodeError:
+            return '', 1
 
-            # send target coord to players
-            msg = str.encode(f"target_coord:{self.target_coord.x},{self.target_coord.y}")
-            self.send_to_ready_players(msg)
+        print("Indetification Phrase: " + new_id)
+        if new_id in taken:
+            return '', 2
 
-            if self.get_responses_from_players_in_list() != 0:
-                print("did not get responses")
+        return new_id, 0
+
+    def open_room(self):
+        '''moves the first players of the lobby into a new room and starts it'''
+        players = list(itertools.islice(self.lobby, self.players_per_room))
+        for p in players:
+            del self.lobby[p]
+
+        room = Room(self, next(self.room_ids), players, self.tick_ms)
+        self.rooms[room.id] = room
+        room.task = asyncio.create_task(room.run_game())
+        print(f"Opened room {room.id}, {len(self.rooms)} rooms running")
+
+    def wait_in_lobby(self, p):
+        '''p is ready, the room opens once enough players wait'''
+        self.lobby[p] = None
+        if len(self.lobby) >= self.players_per_room:
+            self.open_room()
+        self.report_lobby()
+
+    def report_lobby(self, freed=None):
+        '''worker mode: tells the launcher how many players wait in the lobby
+            and the username freed, if any
+        '''
+        if self.launcher is None:
+            return
+
+        report = {'lobby': len(self.lobby), 'adopted': self.adopted}
+        if freed is not None:
+            report['freed'] = freed
+        try:
+            self.launcher.send(json.dumps(report).encode())
+        except OSError:
+            pass
+
+    def close_room(self, room):
+        # game over -- disconnect players
+        for p in room.ready_list:
+            self.remove_player(p)
+
+        del self.rooms[room.id]
+        print(f"Closed room {room.id}, {len(self.rooms)} rooms running")
+
+    async def start(self, reuse_port=False):
+        '''listens on host:port, reuse_port lets several worker processes share it
+            udp snapshots are only offered by a single process (reuse_port off)
+        '''
+        self.server = await asyncio.start_server(self.handle_player, self.host, self.port,
+                                                 reuse_address=True, reuse_port=reuse_port)
+        if not reuse_port:
+            await self.start_udp(self.port)
+
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def start_udp(self, udp_port):
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: UdpEndpoint(self), local_addr=(self.host, udp_port))
+        self.udp_port = udp_port
+
+    def send_datagram(self, p, datagram):
+        self.udp_transport.sendto(datagram, p.udp_addr)
+
+    def udp_hello(self, data, addr):
+        '''a client announces the address its udp snapshots go to'''
+        if len(data) != protocol.UDP_HELLO.size:
+            return
+
+        token, = protocol.UDP_HELLO.unpack(data)
+        p = self.udp_tokens.get(token)
+        if p is None and self.launcher is not None:
+            # the launcher gave out the token, the player follows once its handshake is done
+            if len(self.early_hellos) >= EARLY_HELLOS:
+                del self.early_hellos[next(iter(self.early_hellos))]
+            self.early_hellos[token] = addr
+        elif p is not None and p.udp_addr != addr:
+            p.udp_addr = addr
+            print(f"Player {p.id} receives snapshots over udp at {addr}")
+
+    def give_udp_token(self, p):
+        if self.udp_transport is None:
+            p.send(protocol.encode_text(MsgType.ERROR, 'UDP UNAVAILABLE'))
+            return
+
+        if p.udp_token is None:
+            p.udp_token = rd.getrandbits(32)
+            while p.udp_token in self.udp_tokens:
+                p.udp_token = rd.getrandbits(32)
+            self.udp_tokens[p.udp_token] = p
+
+        p.send(protocol.encode(MsgType.UDP_TOKEN, protocol.UDP_TOKEN.pack(p.udp_token, self.udp_port)))
+
+    async def serve_handoff(self, channel, udp_port=None):
+        '''worker mode: serves the players the launcher took through the handshake and passed over channel
+            the lobby size goes back over channel after every change
+            udp snapshots are offered on udp_port if given
+        '''
+        loop = asyncio.get_running_loop()
+        if udp_port is not None:
+            await self.start_udp(udp_port)
+        channel_closed = loop.create_future()
+        channel.setblocking(False)
+        self.launcher = channel
+
+        def on_channel_readable():
+            # one SOCK_SEQPACKET message per connection, the ready player as json
+            while True:
+                try:
+                    msg, fds, _, _ = socket.recv_fds(channel, 4096, 1)
+                except BlockingIOError:
+                    return
+
+                if len(msg) == 0:
+                    # launcher went away
+                    loop.remove_reader(channel.fileno())
+                    channel_closed.set_result(None)
+                    return
+
+                for fd in fds:
+                    loop.create_task(self.adopt_connection(socket.socket(fileno=fd), json.loads(msg)))
+
+        loop.add_reader(channel.fileno(), on_channel_readable)
+        await channel_closed
+
+    async def adopt_connection(self, sock, ready):
+        reader, writer = await asyncio.open_connection(sock=sock)
+        await self.handle_player(reader, writer, ready)
+
+    async def handle_player(self, reader, writer, ready=None):
+        '''per connection task: reads every message of the player
+            ready: the handshake the launcher did for this player, if any
+        '''
+        player = Player(reader, writer, "")
+        self.connections.add(player)
+        print(f"Connected by {player.addr}")
+        if ready is not None:
+            self.adopt_player(player, ready)
+
+        while True:
+            try:
+                msg_type, payload = await protocol.read_frame(reader)
+            except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+                break
+
+            if msg_type == MsgType.CLOCK:
+                self.answer_clock(player, payload)
+            elif player.room is not None:
+                player.room.dispatch_game_message(player, msg_type, payload)
+            elif not self.handshake(player, msg_type, payload):
+                break
+
+        # conn closed - drop player
+        if player.room is not None:
+            # the room task does the cleanup
+            player.room.player_closed(player)
+        else:
+            self.remove_player(player)
+
+    def answer_clock(self, p, payload):
+        '''stamps a clock sync request with the server's monotonic clock'''
+        client_ns, error = protocol.decode_clock_ns(payload)
+        if error:
+            print(f"Player {p.addr} sent a bad clock request")
+            return
+
+        p.send(protocol.encode(MsgType.CLOCK, protocol.CLOCK_REPLY.pack(client_ns, time.monotonic_ns())))
+
+    def adopt_player(self, p, ready):
+        '''registers a player the launcher took through the handshake, its screen size is acked here'''
+        p.id = ready['id']
+        self.players[p.id] = p
+        self.adopted += 1
+
+        token = ready['udp_token']
+        if token is not None and token not in self.udp_tokens:
+            p.udp_token = token
+            self.udp_tokens[token] = p
+            p.udp_addr = self.early_hellos.pop(token, None)
+            if p.udp_addr is not None:
+                print(f"Player {p.id} receives snapshots over udp at {p.udp_addr}")
+
+        p.setScreenSize(ready['height'], ready['width'])
+        print(f"Player {p.id} @ScreenSize: {p.screen_height}x{p.screen_width}")
+        p.send(protocol.encode(MsgType.OK))
+        self.wait_in_lobby(p)
+
+    def remove_player(self, player):
+        if player.udp_token is not None:
+            del self.udp_tokens[player.udp_token]
+            player.udp_token = None
+
+        freed = None
+        self.lobby.pop(player, None)
+        if self.players.get(player.id) is player:
+            del self.players[player.id]
+            freed = player.id
+        self.report_lobby(freed)
+
+        if player in self.connections:
+            self.connections.remove(player)
+            player.close()
+            print(f"removed player {player.addr}")
+
+    def handshake(self, p, msg_type, payload):
+        '''handles a message from a player not yet in a room
+            returns False if the player has to be dropped
+        '''
+        player_status = p.status()
+
+        if msg_type == MsgType.USE_UDP and player_status != PlayerStatus.WAITING_FOR_USERNAME:
+            self.give_udp_token(p)
+            return True
+
+        if player_status == PlayerStatus.WAITING_FOR_USERNAME:
+            # we expect username:%username%
+            username, error = self.is_username_valid(msg_type, payload, self.players)
+
+            if error == 1:
+                p.send(protocol.encode_text(MsgType.ERROR, 'INVALID ID PHRASE'))
                 return False
 
-            print('end of comm loop\n\n')
-            self.last_message_time = round(time.time() * 1000)
+            if error == 2:
+                # client should prompt user to choose a differ username
+                p.send(protocol.encode_text(MsgType.ERROR, 'ID UNAVAILABLE'))
+                return True
+
+            p.id = username
+            self.players[username] = p
+            print(f"Player {p.addr} @user: {username}")
+            p.send(protocol.encode(MsgType.OK))
+
+        elif player_status == PlayerStatus.WAITING_FOR_SCREEN_SIZE:
+            # handle screen_size:<height>x<width>
+            height, width, error = Player.is_screen_size_valid(msg_type, payload)
+
+            if error == 1:
+                p.send(protocol.encode_text(MsgType.ERROR, 'INVALID SCREEN-SIZE PHRASE'))
+                return True
+
+            if error == 2:
+                p.send(protocol.encode_text(MsgType.ERROR, 'INVALID SCREEN_SIZE'))
+                return True
+
+            p.setScreenSize(height, width)
+            print(f"Player {p.id} @ScreenSize: {height}x{width}")
+            p.send(protocol.encode(MsgType.OK))
+
+            # player is ready, wait in the lobby for an opponent
+            self.wait_in_lobby(p)
 
         return True
 
 
-gameServer = Server("127.0.0.1", 5555)
-gameServer.start()
+if __name__ == '__main__':
+    gameServer = Server(None, 5555)
+    asyncio.run(gameServer.start())
@@ -0,0 +1,245 @@
+''' Runs the game server on several worker processes
+
+    default mode: the launcher accepts every connection, takes the player through
+    the handshake and only then hands the socket to a worker over a unix socket.
+    the workers report their lobby size back, a ready player goes to the worker
+    whose lobby is closest to a full room (--players, PLAYERS_PER_ROOM by default),
+    so a connection that never completes its handshake keeps nobody waiting.
+
+    worker i offers udp snapshots on port + 1 + i. a player asking for udp is
+    given the worker picked at that point of its handshake.
+
+    --reuseport mode: every worker listens on the port itself (SO_REUSEPORT)
+    and the kernel spreads the connections. matchmaking is then per worker,
+    which only pairs players well under load, and there are no udp snapshots.
+'''
+
+import argparse
+import asyncio
+import multiprocessing
+import json
+import os
+import signal
+import socket
+import sys
+import time
+import random as rd
+import game_server
+import protocol
+from game_server import Player, Server, MAX_PLAYERS_PER_ROOM, PLAYERS_PER_ROOM, TICK_MS
+from protocol import MsgType
+
+
+def run_worker(host, port, tick_ms, channel=None, udp_port=None, replay_dir=None, players_per_room=PLAYERS_PER_ROOM):
+    '''worker process: serves connections from channel, or listens with SO_REUSEPORT'''
+    server = Server(host, port, tick_ms, replay_dir, players_per_room)
+
+    try:
+        if channel is None:
+            asyncio.run(server.start(reuse_port=True))
+        else:
+            asyncio.run(server.serve_handoff(channel, udp_port))
+    except KeyboardInterrupt:
+        pass
+
+
+class Launcher:
+
+    def __init__(self, host, port, workers, tick_ms=TICK_MS, reuse_port=False, replay_dir=None,
+                 players_per_room=PLAYERS_PER_ROOM):
+        self.host = host
+        self.port = port
+        self.worker_count = workers
+        self.tick_ms = tick_ms
+        self.reuse_port = reuse_port
+        self.replay_dir = replay_dir
+        self.players_per_room = players_per_room
+
+        self.processes = []
+        self.channels = []      # launcher end of each worker's unix socket
+        self.names = set()      # usernames of the players in the handshake or on a worker
+
+        # per worker: players waiting in its lobby as last reported, players handed
+        # over and, of those, the ones it reported as taken in
+        self.lobbies = [0] * workers
+        self.sent = [0] * workers
+        self.adopted = [0] * workers
+        self.rooms = 0          # rooms started on an empty lobby, round-robin
+
+    def start_workers(self):
+        ctx = multiprocessing.get_context('fork')
+
+        for i in range(self.worker_count):
+            worker_channel = None
+            udp_port = None
+            if not self.reuse_port:
+                channel, worker_channel = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+                self.channels.append(channel)
+                udp_port = self.port + 1 + i
+
+            p = ctx.Process(target=run_worker, args=(self.host, self.port, self.tick_ms, worker_channel, udp_port, self.replay_dir,
+                                                    self.players_per_room),
+                            daemon=True)
+            p.start()
+            self.processes.append(p)
+
+            if not self.reuse_port:
+                worker_channel.close()
+
+        print(f"Started {self.worker_count} workers on {self.host}:{self.port}")
+
+    def pick_worker(self):
+        '''will return the worker whose lobby is closest to a full room
+            the next worker round-robin if no lobby is partly filled
+        '''
+        waiting = [(self.lobbies[i] + self.sent[i] - self.adopted[i]) % self.players_per_room
+                   for i in range(self.worker_count)]
+        fullest = max(range(self.worker_count), key=lambda i: waiting[i])
+        if waiting[fullest] > 0:
+            return fullest
+
+        self.rooms += 1
+        return (self.rooms - 1) % self.worker_count
+
+    def read_reports(self, worker):
+        '''a worker's lobby changed or a username it held is free again'''
+        while True:
+            try:
+                msg = self.channels[worker].recv(4096)
+            except BlockingIOError:
+                return
+
+            if len(msg) == 0:
+                print(f"Worker {worker} went away")
+                asyncio.get_running_loop().remove_reader(self.channels[worker].fileno())
+                return
+
+            report = json.loads(msg)
+            self.lobbies[worker] = report['lobby']
+            self.adopted[worker] = report['adopted']
+            self.names.discard(report.get('freed'))
+
+    async def handshake(self, reader, writer):
+        '''per connection task: the handshake of game_server.Server, the worker gets the player once it is ready
+            the worker acks the screen size
+        '''
+        username = None
+        udp_token = None
+        worker = None
+
+        try:
+            while True:
+                try:
+                    msg_type, payload = await protocol.read_frame(reader)
+                except (asyncio.IncompleteReadError, ConnectionError, ValueError, asyncio.CancelledError):
+                    # cancelled: the launcher is stopping
+                    return
+
+                if msg_type == MsgType.CLOCK:
+                    client_ns, error = protocol.decode_clock_ns(payload)
+                    if not error:
+                        writer.write(protocol.encode(MsgType.CLOCK, protocol.CLOCK_REPLY.pack(client_ns, time.monotonic_ns())))
+
+                elif username is None:
+                    name, error = Server.is_username_valid(msg_type, payload, self.names)
+                    if error == 1:
+                        writer.write(protocol.encode_text(MsgType.ERROR, 'INVALID ID PHRASE'))
+                        return
+                    if error == 2:
+                        writer.write(protocol.encode_text(MsgType.ERROR, 'ID UNAVAILABLE'))
+                        continue
+
+                    username = name
+                    self.names.add(username)
+                    writer.write(protocol.encode(MsgType.OK))
+
+                elif msg_type == MsgType.USE_UDP:
+                    # the token is only known to the worker the player ends up on
+                    if udp_token is None:
+                        udp_token = rd.getrandbits(32)
+                        worker = self.pick_worker()
+                    writer.write(protocol.encode(MsgType.UDP_TOKEN, protocol.UDP_TOKEN.pack(udp_token, self.port + 1 + worker)))
+
+                else:
+                    height, width, error = Player.is_screen_size_valid(msg_type, payload)
+                    if error == 1:
+                        writer.write(protocol.encode_text(MsgType.ERROR, 'INVALID SCREEN-SIZE PHRASE'))
+                        continue
+                    if error == 2:
+                        writer.write(protocol.encode_text(MsgType.ERROR, 'INVALID SCREEN_SIZE'))
+                        continue
+
+                    if worker is None:
+                        worker = self.pick_worker()
+                    ready = {'id': username, 'height': height, 'width': width, 'udp_token': udp_token}
+                    sock = writer.get_extra_info('socket')
+                    socket.send_fds(self.channels[worker], [json.dumps(ready).encode()], [sock.fileno()])
+                    self.sent[worker] += 1
+                    # the worker owns the player from now on, its username included
+                    username = None
+                    return
+        except OSError as e:
+            print(f"Handshake failed: {e}")
+        finally:
+            self.names.discard(username)
+            writer.close()
+
+    async def serve_handshakes(self):
+        loop = asyncio.get_running_loop()
+        for i, channel in enumerate(self.channels):
+            channel.setblocking(False)
+            loop.add_reader(channel.fileno(), self.read_reports, i)
+
+        server = await asyncio.start_server(self.handshake, self.host, self.port,
+                                            reuse_address=True, backlog=socket.SOMAXCONN)
+        async with server:
+            await server.serve_forever()
+
+    def serve(self):
+        self.start_workers()
+
+        if self.reuse_port:
+            for p in self.processes:
+                p.join()
+            return
+
+        asyncio.run(self.serve_handshakes())
+
+    def stop(self):
+        for channel in self.channels:
+            channel.close()
+
+        for p in self.processes:
+            p.terminate()
+            p.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="multi-process snake game server")
+    parser.add_argument('--host', default=None, help="address to listen on (default: this machine's ip)")
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--tick-ms', type=float, default=TICK_MS)
+    parser.add_argument('--reuseport', action='store_true', help="let workers share the port instead of handing off connections")
+    parser.add_argument('--replay-dir', default=None, help="save a log of every match there, see replay.py")
+    parser.add_argument('--players', type=int, default=PLAYERS_PER_ROOM, help=f"players per match, 2 to {MAX_PLAYERS_PER_ROOM}")
+    args = parser.parse_args()
+
+    if not 2 <= args.players <= MAX_PLAYERS_PER_ROOM:
+        parser.error(f"--players must be in [2, {MAX_PLAYERS_PER_ROOM}]")
+
+    host = args.host if args.host else game_server.get_my_ip()
+    launcher = Launcher(host, args.port, args.workers, args.tick_ms, args.reuseport, args.replay_dir, args.players)
+
+    # stop the workers too when terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        launcher.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        launcher.stop()
+
+if __name__ == '__main__':
+    main()
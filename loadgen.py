@@ -0,0 +1,152 @@
+''' Headless load generator: many bot clients playing against a running server
+
+    every bot is a thread playing games back to back until the duration is
+    over. at the end the connect rate, handshake time, tick jitter, move
+    latency and received bytes are printed.
+
+    python loadgen.py --host 127.0.0.1 --port 5555 --bots 1000 --duration 60
+    python loadgen.py --spawn-server --workers 4 --bots 200 --duration 30
+'''
+
+import argparse
+import itertools
+import os
+import random as rd
+import subprocess
+import sys
+import threading
+import time
+from bot_client import BotClient, BotStats
+from coord import Coord
+from game_server import PLAYERS_PER_ROOM, TICK_MS
+
+THREAD_STACK_SIZE = 256 * 1024     # thousands of bot threads
+RETRY_SECONDS = 0.5                # after a failed game, doubled up to RETRY_MAX_SECONDS
+RETRY_MAX_SECONDS = 8
+JOIN_GRACE_SECONDS = 5             # past the duration, for the last messages
+
+
+def percentile(values, p):
+    '''nearest-rank percentile of values, None if empty'''
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = max(1, round(p / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def run_bot(index, args, deadline, stats):
+    rng = rd.Random(args.seed + index if args.seed is not None else None)
+
+    retry = RETRY_SECONDS
+    for attempt in itertools.count():
+        if time.perf_counter() >= deadline:
+            break
+
+        # a new name every game, a refused one is not asked for again
+        bot = BotClient(f'bot{index}-{attempt}', args.host, args.port, (args.height, args.width), args.script,
+                        args.move_every, args.udp, rng=rng, stats=stats)
+        if bot.play(deadline):
+            retry = RETRY_SECONDS
+            continue
+
+        # connect, handshake or game failed: back off rather than reconnect at once
+        time.sleep(min(retry, max(deadline - time.perf_counter(), 0)))
+        retry = min(retry * 2, RETRY_MAX_SECONDS)
+
+
+def spawn_server(args):
+    '''starts launcher.py, its output is thrown away'''
+    launcher = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'launcher.py')
+    cmd = [sys.executable, launcher, '--host', args.host, '--port', str(args.port),
+           '--workers', str(args.workers), '--tick-ms', str(args.tick_ms), '--players', str(args.players)]
+
+    return subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def format_ms(seconds):
+    return 'n/a' if seconds is None else f'{seconds * 1000:.2f} ms'
+
+
+def report(all_stats, elapsed, tick_ms):
+    connects = [c for s in all_stats for c in s.connects_s]
+    handshakes = [h for s in all_stats for h in s.handshakes_s]
+    rtts = [rtt for s in all_stats for rtt in s.move_rtts_s]
+    jitters = [abs(interval - tick_ms / 1000) for s in all_stats for interval in s.tick_intervals_s]
+    games = sum(s.games for s in all_stats)
+    bytes_received = sum(s.bytes_received for s in all_stats)
+    errors = [e for s in all_stats for e in s.errors]
+
+    print(f"bots:            {len(all_stats)}")
+    print(f"elapsed:         {elapsed:.1f} s")
+    print(f"connected:       {len(connects)} ({len(connects) / elapsed:.1f}/s)")
+    print(f"connect p50/p99: {format_ms(percentile(connects, 50))} / {format_ms(percentile(connects, 99))}")
+    print(f"handshake p50/p99: {format_ms(percentile(handshakes, 50))} / {format_ms(percentile(handshakes, 99))}")
+    print(f"games finished:  {games}")
+    print(f"ticks received:  {len(jitters)}")
+    print(f"tick jitter p50/p99/max: {format_ms(percentile(jitters, 50))} / {format_ms(percentile(jitters, 99))}"
+          f" / {format_ms(max(jitters) if jitters else None)}")
+    print(f"moves:           {len(rtts)}")
+    print(f"move latency p50/p99: {format_ms(percentile(rtts, 50))} / {format_ms(percentile(rtts, 99))}")
+    print(f"received:        {bytes_received} bytes ({bytes_received / elapsed / 1024:.1f} KiB/s)")
+    print(f"errors:          {len(errors)}")
+    for error in sorted(set(errors)):
+        print(f"    {errors.count(error)} x {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="load generator for the snake game server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--bots', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=30, help="seconds")
+    parser.add_argument('--udp', action='store_true', help="ask for snapshots over udp")
+    parser.add_argument('--script', default=None,
+                        help="comma separated moves played in turn, e.g. up,right,down,right (default: random)")
+    parser.add_argument('--move-every', type=int, default=3, help="ticks between two moves")
+    parser.add_argument('--height', type=int, default=40)
+    parser.add_argument('--width', type=int, default=120)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--tick-ms', type=float, default=TICK_MS, help="server tick, for the jitter")
+    parser.add_argument('--spawn-server', action='store_true', help="run launcher.py for the duration")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="with --spawn-server")
+    parser.add_argument('--players', type=int, default=PLAYERS_PER_ROOM, help="players per match, with --spawn-server")
+    args = parser.parse_args()
+
+    if args.script is not None:
+        args.script = args.script.split(',')
+        for move in args.script:
+            if move not in Coord.DIRECTIONS:
+                parser.error(f"invalid move {move}")
+
+    server = None
+    if args.spawn_server:
+        server = spawn_server(args)
+        time.sleep(1)
+
+    threading.stack_size(THREAD_STACK_SIZE)
+    all_stats = [BotStats() for _ in range(args.bots)]
+
+    start = time.perf_counter()
+    deadline = start + args.duration
+    threads = [threading.Thread(target=run_bot, args=(i, args, deadline, all_stats[i]), daemon=True)
+               for i in range(args.bots)]
+    for t in threads:
+        t.start()
+
+    try:
+        # bots waiting for an opponent or a snapshot stop at the next message
+        join_deadline = deadline + JOIN_GRACE_SECONDS
+        for t in threads:
+            t.join(max(0, join_deadline - time.perf_counter()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        report(all_stats, time.perf_counter() - start, args.tick_ms)
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+if __name__ == '__main__':
+    main()
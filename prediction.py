@@ -0,0 +1,179 @@
+''' Client-side prediction of my snake and interpolation of the others
+
+    snapshots arrive one network delay after the server played their tick
+    and my moves reach the server one network delay after the key. the
+    client draws its own snake ahead of the last snapshot, replaying the
+    moves the server has not taken yet with the server's queue rule, and
+    draws the other snakes a steady tick behind, from a short history, so
+    bunched or late snapshots do not make them jump.
+
+    every snapshot reconciles: prediction starts over from the server's
+    body and the moves it reports as applied are dropped.
+'''
+
+import itertools
+from collections import deque
+from coord import Coord
+from engine import OPPOSITE
+from snake_body import SnakeBody
+
+DEFAULT_TICK_SECONDS = 0.1      # until the snapshots tell
+RATE_MIN_TICKS = 5              # snapshots apart before measuring the tick period
+CLOCK_SMOOTHING = 0.05          # how fast the clock follows later snapshots
+RTT_SMOOTHING = 0.2
+MAX_PREDICTED_TICKS = 10        # ahead of the last snapshot
+INTERPOLATION_DELAY_TICKS = 1   # other snakes are drawn that far behind
+HISTORY_TICKS = 16
+
+
+class TickClock:
+    '''estimates which server tick is arriving now from the snapshot arrival times
+
+        the least delayed snapshot sets the clock at once, later ones only
+        pull it slowly, so jitter does not move it
+    '''
+
+    def __init__(self, tick_s=DEFAULT_TICK_SECONDS):
+        self.tick_s = tick_s
+        self.first = None       # (tick, arrival) of the first snapshot
+        self.tick_zero = None   # arrival time of tick 0
+
+    def on_snapshot(self, tick, now):
+        if self.first is None:
+            self.first = (tick, now)
+        elif tick - self.first[0] >= RATE_MIN_TICKS:
+            self.tick_s = (now - self.first[1]) / (tick - self.first[0])
+
+        sample = now - tick * self.tick_s
+        if self.tick_zero is None or sample < self.tick_zero:
+            self.tick_zero = sample
+        else:
+            self.tick_zero += (sample - self.tick_zero) * CLOCK_SMOOTHING
+
+    def server_tick(self, now):
+        '''fractional tick of the snapshot arriving now, None before the first'''
+        if self.tick_zero is None:
+            return None
+        return (now - self.tick_zero) / self.tick_s
+
+
+def heading(body):
+    '''direction of the last move of body, from its two first cells'''
+    if len(body) < 2:
+        return 'right'
+
+    move = (body[0].x - body[1].x, body[0].y - body[1].y)
+    if move not in Coord.DIRECTIONS_MOVES:
+        return 'right'
+    return Coord.DIRECTIONS[Coord.DIRECTIONS_MOVES.index(move)]
+
+
+def predict_snake(body, tick, moves, to_tick, is_free):
+    '''body at tick moved on to to_tick
+        moves: (tick, direction) not applied by the server yet, in order, each
+        taken no earlier than its tick and at most one per tick, skipping moves
+        along or against the snake as the server does.
+        no growth, and the snake stops in front of a cell that is not free,
+        the server says what happens there
+        will return a new SnakeBody
+    '''
+    predicted = SnakeBody(body)
+    direction = heading(body)
+    moves = deque(moves)
+
+    for t in range(tick + 1, to_tick + 1):
+        while moves and moves[0][0] <= t:
+            _, move = moves.popleft()
+            if move != direction and move != OPPOSITE[direction]:
+                direction = move
+                break
+
+        head = predicted.next_head(direction)
+        if not is_free(head):
+            break
+        predicted.push_head(head)
+        predicted.pop_tail()
+
+    return predicted
+
+
+class Prediction:
+    '''my moves in flight, the tick clock and the history of the other snakes'''
+
+    def __init__(self):
+        self.clock = TickClock()
+        self.pending = deque()      # (sequence number, tick to apply, direction, sent)
+        self.rtt_s = 0.0            # move sent -> snapshot reporting it applied
+        # (tick, dict of slot -> body, dict of slot -> tail the tick popped off it)
+        # bodies are the client's, later snapshots move them, see body_at
+        self.history = deque(maxlen=HISTORY_TICKS)
+        self.rebuilt = (None, None)     # (tick, dict of slot -> coords) other_snakes drew last
+
+    def lead_ticks(self):
+        return self.rtt_s / self.clock.tick_s
+
+    def predicted_tick(self, last_tick, now):
+        '''the tick my snake is drawn at'''
+        server_tick = self.clock.server_tick(now)
+        if server_tick is None:
+            return last_tick
+        return max(last_tick, min(int(server_tick + self.lead_ticks()), last_tick + MAX_PREDICTED_TICKS))
+
+    def sent(self, seq, direction, last_tick, now):
+        # the server takes it on the tick after the one drawn now
+        self.pending.append((seq, self.predicted_tick(last_tick, now) + 1, direction, now))
+
+    def on_snapshot(self, tick, moves_applied, others, popped, now):
+        '''others: dict of slot -> body of the other snakes, not copied
+            popped: dict of slot -> the tail this snapshot took off the body, if it moved it without growing
+        '''
+        self.clock.on_snapshot(tick, now)
+
+        while self.pending and self.pending[0][0] <= moves_applied:
+            _, _, _, sent = self.pending.popleft()
+            if sent < self.clock.first[1]:
+                # sent before the game started, it waited for the first tick
+                continue
+            sample = now - sent
+            self.rtt_s = sample if self.rtt_s == 0.0 else self.rtt_s + (sample - self.rtt_s) * RTT_SMOOTHING
+
+        self.history.append((tick, others, popped))
+
+    def my_snake(self, body, last_tick, now, is_free):
+        return predict_snake(body, last_tick, [(t, d) for _, t, d, _ in self.pending],
+                             self.predicted_tick(last_tick, now), is_free)
+
+    def other_snakes(self, now):
+        '''slot -> coords of the other snakes INTERPOLATION_DELAY_TICKS behind the arriving tick'''
+        if not self.history:
+            return {}
+
+        server_tick = self.clock.server_tick(now)
+        render_tick = int(server_tick) - INTERPOLATION_DELAY_TICKS
+        chosen = 0
+        for i, (tick, _, _) in enumerate(self.history):
+            if tick > render_tick:
+                break
+            chosen = i
+
+        tick, snakes, _ = self.history[chosen]
+        if chosen == len(self.history) - 1:
+            # as the client has them
+            return snakes
+
+        if self.rebuilt[0] != tick:
+            self.rebuilt = (tick, {slot: self.body_at(chosen, slot) for slot in snakes})
+        return self.rebuilt[1]
+
+    def body_at(self, index, slot):
+        '''the coords of a body as history[index] had it
+            the later snapshots that moved the same body are undone: the tails
+            they popped are put back and their heads dropped
+        '''
+        _, snakes, _ = self.history[index]
+        body = snakes[slot]
+        later = [popped for _, newer, popped in itertools.islice(self.history, index + 1, None) if newer.get(slot) is body]
+
+        # the tails put back come after the body, a tail popped may be a later head too
+        tails = (popped[slot] for popped in reversed(later) if slot in popped)
+        return list(itertools.islice(itertools.chain(body, tails), len(later), None))
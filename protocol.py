@@ -0,0 +1,283 @@
+''' Binary wire protocol shared by game_server and game_client
+
+    every message is a frame: <u32 payload length><u8 message type><payload>
+    coordinates are packed as little-endian int16 (x, y) pairs
+
+    a tick is one SNAPSHOT of the whole room, shared by all its players:
+    SNAPSHOT_HEADER <u32 tick><u8 flags><u8 snake count>,
+    the target COORD if FLAG_TARGET is set, then for every snake
+    SNAKE_HEADER <u8 slot><u8 flags><u32 score><u32 moves applied><u32 coord count>
+    and its COORDs head first: only the new head in a delta snapshot, the whole
+    body in a keyframe (FLAG_KEYFRAME)
+
+    optional UDP snapshot channel (TCP still carries everything else):
+    the client sends UDP_HELLO <u32 token> datagrams, the server sends
+    DATAGRAM_HEADER <u32 moves applied><u8 snapshot count>, then every
+    snapshot payload prefixed with its <u32 length>, oldest first
+
+    clock sync: the client sends CLOCK <i64 its monotonic ns>, the server
+    answers at once with CLOCK <i64 the same ns><i64 its monotonic ns>, in
+    any state. START carries the start instant on the server's monotonic
+    clock, every client converts it with the offset it measured
+'''
+
+import struct
+from collections import deque
+from enum import IntEnum
+from coord import Coord
+
+HEADER = struct.Struct('<IB')
+COORD = struct.Struct('<hh')
+SCREEN_SIZE = struct.Struct('<hh')     # height, width
+BYTE = struct.Struct('<B')
+SNAPSHOT_HEADER = struct.Struct('<IBB')
+SNAKE_HEADER = struct.Struct('<BBIII')
+UDP_TOKEN = struct.Struct('<IH')       # token, server udp port
+UDP_HELLO = struct.Struct('<I')        # token
+DATAGRAM_HEADER = struct.Struct('<IB')
+LENGTH = struct.Struct('<I')
+CLOCK_NS = struct.Struct('<q')          # monotonic_ns
+CLOCK_REPLY = struct.Struct('<qq')     # client monotonic_ns, server monotonic_ns
+
+# snapshot flags
+FLAG_TARGET = 1     # the target coord follows the header
+FLAG_KEYFRAME = 2   # snakes carry their whole body
+
+# snake flags
+FLAG_GROW = 1       # delta: the tail was not popped
+
+# frames announcing a bigger payload are rejected
+MAX_PAYLOAD_SIZE = 1 << 20
+
+RESULTS = ['draw', 'win', 'loss']
+
+
+class MsgType(IntEnum):
+    OK = 0
+    ERROR = 1               # utf-8 error message
+    BUSY = 2
+    USERNAME = 3            # utf-8 username
+    SCREEN_SIZE = 4         # SCREEN_SIZE
+    SHARED_SCREEN_SIZE = 5  # SCREEN_SIZE
+    YOUR_SLOT = 6           # BYTE slot of the player's snake in snapshots
+    SNAPSHOT = 7            # state of the room after a tick
+    START = 9               # CLOCK_NS server monotonic ns of the start
+    ACK = 10                # BYTE errno
+    MY_MOVE = 11            # BYTE index in Coord.DIRECTIONS, not answered
+    QUITTING = 12
+    ENEMY_QUIT = 13
+    RESULT = 14             # BYTE index in RESULTS
+    USE_UDP = 15            # client asks for snapshots over udp
+    UDP_TOKEN = 16          # UDP_TOKEN
+    CLOCK = 17              # CLOCK_NS from the client, CLOCK_REPLY from the server
+
+
+def encode(msg_type, payload=b''):
+    return HEADER.pack(len(payload), msg_type) + payload
+
+def encode_text(msg_type, text):
+    return encode(msg_type, str.encode(text))
+
+def encode_byte(msg_type, value):
+    return encode(msg_type, BYTE.pack(value))
+
+def encode_clock_ns(msg_type, ns):
+    return encode(msg_type, CLOCK_NS.pack(ns))
+
+def encode_screen_size(msg_type, height, width):
+    return encode(msg_type, SCREEN_SIZE.pack(height, width))
+
+def pack_coords(coords):
+    flat = []
+    for c in coords:
+        flat.append(c.x)
+        flat.append(c.y)
+
+    return struct.pack(f'<{len(flat)}h', *flat)
+
+def pack_snapshot(tick, snakes, target=None, keyframe=False):
+    '''will return the SNAPSHOT payload
+        snakes: list of (slot, coords, grew, score, moves applied)
+        moves applied: MY_MOVEs of the snake's player taken by the server so far
+        a delta snapshot only carries the head coords[0] of every snake
+    '''
+    flags = 0
+    if target is not None:
+        flags |= FLAG_TARGET
+    if keyframe:
+        flags |= FLAG_KEYFRAME
+
+    parts = [SNAPSHOT_HEADER.pack(tick, flags, len(snakes))]
+    if target is not None:
+        parts.append(COORD.pack(target.x, target.y))
+
+    for slot, coords, grew, score, moves_applied in snakes:
+        if not keyframe:
+            coords = [coords[0]]
+
+        parts.append(SNAKE_HEADER.pack(slot, FLAG_GROW if grew else 0, score, moves_applied, len(coords)))
+        parts.append(pack_coords(coords))
+
+    return b''.join(parts)
+
+def decode_snapshot(payload):
+    '''will return (tick, flags, target or None, list of (slot, flags, score, moves applied, coords), errno)'''
+    if len(payload) < SNAPSHOT_HEADER.size:
+        return 0, 0, None, [], 2
+
+    tick, flags, count = SNAPSHOT_HEADER.unpack_from(payload)
+    offset = SNAPSHOT_HEADER.size
+
+    target = None
+    if flags & FLAG_TARGET:
+        if len(payload) < offset + COORD.size:
+            return 0, 0, None, [], 2
+        target = Coord(*COORD.unpack_from(payload, offset))
+        offset += COORD.size
+
+    snakes = []
+    for _ in range(count):
+        if len(payload) < offset + SNAKE_HEADER.size:
+            return 0, 0, None, [], 2
+        slot, snake_flags, score, moves_applied, length = SNAKE_HEADER.unpack_from(payload, offset)
+        offset += SNAKE_HEADER.size
+
+        end = offset + length * COORD.size
+        if length == 0 or len(payload) < end:
+            return 0, 0, None, [], 2
+        coords, _ = decode_coords(payload[offset:end])
+        offset = end
+
+        snakes.append((slot, snake_flags, score, moves_applied, coords))
+
+    if offset != len(payload):
+        return 0, 0, None, [], 2
+
+    return tick, flags, target, snakes, 0
+
+def snapshot_tick(payload):
+    '''will return the tick of a SNAPSHOT payload, -1 if too short'''
+    if len(payload) < SNAPSHOT_HEADER.size:
+        return -1
+
+    return LENGTH.unpack_from(payload)[0]
+
+def encode_datagram(moves_applied, snapshot_payloads):
+    parts = [DATAGRAM_HEADER.pack(moves_applied, len(snapshot_payloads))]
+    for payload in snapshot_payloads:
+        parts.append(LENGTH.pack(len(payload)))
+        parts.append(payload)
+
+    return b''.join(parts)
+
+def decode_datagram(data):
+    '''will return (moves applied, list of snapshot payloads, errno)'''
+    if len(data) < DATAGRAM_HEADER.size:
+        return 0, [], 2
+
+    moves_applied, count = DATAGRAM_HEADER.unpack_from(data)
+    offset = DATAGRAM_HEADER.size
+
+    payloads = []
+    for _ in range(count):
+        if len(data) < offset + LENGTH.size:
+            return 0, [], 2
+        length, = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+
+        if len(data) < offset + length:
+            return 0, [], 2
+        payloads.append(data[offset:offset + length])
+        offset += length
+
+    return moves_applied, payloads, 0
+
+def decode_coords(payload):
+    '''will return (list of Coord, errno)'''
+    if len(payload) % COORD.size:
+        return [], 2
+
+    return [Coord(x, y) for x, y in COORD.iter_unpack(payload)], 0
+
+def decode_screen_size(payload):
+    '''will return (height, width, errno)'''
+    if len(payload) != SCREEN_SIZE.size:
+        return 0, 0, 2
+
+    height, width = SCREEN_SIZE.unpack(payload)
+    if height <= 0 or width <= 0:
+        return 0, 0, 2
+
+    return height, width, 0
+
+def decode_byte(payload):
+    '''will return (value, errno)'''
+    if len(payload) != BYTE.size:
+        return 0, 2
+
+    return payload[0], 0
+
+def decode_clock_ns(payload):
+    '''will return (ns, errno)'''
+    if len(payload) != CLOCK_NS.size:
+        return 0, 2
+
+    return CLOCK_NS.unpack(payload)[0], 0
+
+def decode_clock_reply(payload):
+    '''will return (client ns, server ns, errno)'''
+    if len(payload) != CLOCK_REPLY.size:
+        return 0, 0, 2
+
+    client_ns, server_ns = CLOCK_REPLY.unpack(payload)
+    return client_ns, server_ns, 0
+
+
+class FrameDecoder:
+    '''streaming decoder: feed it received bytes, pop complete frames'''
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.frames = deque()
+
+    def feed(self, data):
+        '''buffers data and splits off every complete frame
+            raises ValueError for oversized frames
+        '''
+        self.buffer += data
+        offset = 0
+
+        while len(self.buffer) - offset >= HEADER.size:
+            length, msg_type = HEADER.unpack_from(self.buffer, offset)
+            if length > MAX_PAYLOAD_SIZE:
+                raise ValueError(f"frame of {length} bytes is too big")
+
+            end = offset + HEADER.size + length
+            if end > len(self.buffer):
+                break
+
+            self.frames.append((msg_type, bytes(self.buffer[offset + HEADER.size:end])))
+            offset = end
+
+        del self.buffer[:offset]
+
+    def has_frame(self):
+        return len(self.frames) > 0
+
+    def pop(self):
+        '''will return the oldest complete (msg_type, payload)'''
+        return self.frames.popleft()
+
+
+async def read_frame(reader):
+    '''reads one frame from an asyncio StreamReader
+        will return (msg_type, payload)
+        raises asyncio.IncompleteReadError when the connection closes
+        raises ValueError for oversized frames
+    '''
+    length, msg_type = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if length > MAX_PAYLOAD_SIZE:
+        raise ValueError(f"frame of {length} bytes is too big")
+
+    payload = await reader.readexactly(length) if length else b''
+    return msg_type, payload
@@ -0,0 +1,172 @@
+''' Match logs and a replay runner
+
+    a MatchLog holds what it takes to play a match again: the board, the
+    seed of the match's random generator and the inputs of every tick as
+    (tick, slot, direction) and the players who left as (tick, slot). replaying builds the same engine.Engine, feeds
+    it the inputs as fast as the cpu goes, no sockets and no drawing, and
+    compares the final state hash with the recorded one.
+
+    python replay.py match-*.json              replays and checks recorded matches
+    python replay.py --repeat 100 match.json   benchmark
+    python replay.py --check                   checks a match that ends on a quit
+'''
+
+import argparse
+import json
+import random as rd
+import time
+from engine import Engine, INITIAL_SNAKE_LENGTH
+
+
+class MatchLog:
+
+    def __init__(self, seed, width, height, walls, target_space, snakes, snake_length=INITIAL_SNAKE_LENGTH):
+        self.seed = seed
+        self.width = width
+        self.height = height
+        self.walls = walls
+        self.target_space = target_space
+        self.snakes = snakes
+        self.snake_length = snake_length
+
+        self.inputs = []        # (tick, slot, direction)
+        self.quits = []         # (tick, slot) of players who left a running match
+        self.final_tick = 0
+        self.final_hash = None
+
+    def make_engine(self):
+        '''a new Engine with the match's random generator and spawned snakes
+            place the first target with relocate_target, as rooms do
+        '''
+        engine = Engine(self.width, self.height, walls=self.walls, target_space=self.target_space,
+                        rng=rd.Random(self.seed))
+        engine.spawn_snakes(self.snakes, self.snake_length)
+        return engine
+
+    def record(self, tick, inputs):
+        '''inputs: dict of slot -> direction given to the engine step after tick'''
+        for slot, direction in inputs.items():
+            self.inputs.append((tick, slot, direction))
+
+    def quit(self, tick, slot):
+        '''the snake in slot was killed before the engine step after tick'''
+        self.quits.append((tick, slot))
+
+    def finish(self, engine):
+        self.final_tick = engine.tick
+        self.final_hash = engine.state_hash()
+
+    def to_dict(self):
+        return {
+            'seed': self.seed,
+            'width': self.width,
+            'height': self.height,
+            'walls': self.walls,
+            'target_space': self.target_space,
+            'snakes': self.snakes,
+            'snake_length': self.snake_length,
+            'inputs': self.inputs,
+            'quits': self.quits,
+            'final_tick': self.final_tick,
+            'final_hash': self.final_hash,
+        }
+
+    @staticmethod
+    def from_dict(d):
+        log = MatchLog(d['seed'], d['width'], d['height'], tuple(d['walls']),
+                       tuple(tuple(space) for space in d['target_space']), d['snakes'], d['snake_length'])
+        log.inputs = [tuple(i) for i in d['inputs']]
+        log.quits = [tuple(q) for q in d.get('quits', [])]
+        log.final_tick = d['final_tick']
+        log.final_hash = d['final_hash']
+        return log
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @staticmethod
+    def load(path):
+        with open(path) as f:
+            return MatchLog.from_dict(json.load(f))
+
+
+def replay(log):
+    '''plays the match again, will return the engine at the final tick'''
+    engine = log.make_engine()
+    engine.relocate_target()
+
+    inputs_by_tick = {}
+    for tick, slot, direction in log.inputs:
+        inputs_by_tick.setdefault(tick, {})[slot] = direction
+
+    quits_by_tick = {}
+    for tick, slot in log.quits:
+        quits_by_tick.setdefault(tick, []).append(slot)
+
+    while engine.tick < log.final_tick:
+        for slot in quits_by_tick.get(engine.tick, []):
+            engine.kill(slot)
+        engine.step(inputs_by_tick.get(engine.tick))
+
+    # a quit that ended the match came after the last step
+    for slot in quits_by_tick.get(engine.tick, []):
+        engine.kill(slot)
+
+    return engine
+
+
+def check_replay():
+    '''a match of three where a player leaves on the final tick, raises AssertionError'''
+    log = MatchLog(7, 60, 30, (0, 1, 60, 30), ((3, 57), (3, 27)), 3)
+    engine = log.make_engine()
+    engine.relocate_target()
+
+    for tick in range(5):
+        inputs = {2: 'up'} if tick == 2 else {}
+        log.record(engine.tick, inputs)
+        engine.step(inputs)
+
+    # as Room.player_left: the first quit kills the snake, the second ends the match
+    log.quit(engine.tick, 0)
+    engine.kill(0)
+    log.finish(engine)
+
+    replayed = replay(MatchLog.from_dict(json.loads(json.dumps(log.to_dict()))))
+    assert replayed.tick == log.final_tick
+    assert replayed.state_hash() == log.final_hash
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replays recorded matches and checks their final state")
+    parser.add_argument('logs', nargs='*', help="match logs written by the server (--replay-dir)")
+    parser.add_argument('--repeat', type=int, default=1, help="replays of every log, for benchmarks")
+    parser.add_argument('--check', action='store_true', help="check the replay of a match ending on a quit")
+    args = parser.parse_args()
+
+    if args.check:
+        check_replay()
+        print("replay ok")
+        return
+    if not args.logs:
+        parser.error("no match logs")
+
+    logs = [(path, MatchLog.load(path)) for path in args.logs]
+    failed = 0
+    ticks = 0
+
+    start = time.perf_counter()
+    for path, log in logs:
+        for _ in range(args.repeat):
+            engine = replay(log)
+            ticks += engine.tick
+
+        if engine.state_hash() != log.final_hash:
+            failed += 1
+            print(f"{path}: state differs at tick {engine.tick}")
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(logs)} matches, {failed} differ, {ticks} ticks in {elapsed:.2f} s ({ticks / max(elapsed, 1e-9):.0f} ticks/s)")
+
+if __name__ == '__main__':
+    main()
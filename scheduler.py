@@ -0,0 +1,70 @@
+import time
+
+
+class TickScheduler:
+    '''fixed timestep clock based on time.monotonic_ns
+
+        tick n is due at start + n * period, so a late tick does not push
+        back the following ones (no drift). when the loop falls behind,
+        up to max_catch_up due ticks are run back to back and the rest
+        are dropped.
+    '''
+
+    def __init__(self, tick_ms=100, max_catch_up=3):
+        self.period_ns = int(tick_ms * 1_000_000)
+        self.max_catch_up = max_catch_up
+        self.next_tick_ns = 0
+
+        self.ticks = 0          # ticks handed out by due_ticks()
+        self.skipped = 0        # ticks dropped by the catch-up policy
+
+        # jitter: how late due ticks were noticed
+        self.jitter_count = 0
+        self.jitter_sum_ns = 0
+        self.jitter_max_ns = 0
+        self.jitter_last_ns = 0
+
+    def start(self, start_ns=None):
+        '''first tick will be due one period after start_ns (default: now)'''
+        if start_ns is None:
+            start_ns = time.monotonic_ns()
+
+        self.next_tick_ns = start_ns + self.period_ns
+
+    def due_ticks(self):
+        '''will return how many ticks to run now and schedule the next one'''
+        now = time.monotonic_ns()
+        if now < self.next_tick_ns:
+            return 0
+
+        late_ns = now - self.next_tick_ns
+        due = late_ns // self.period_ns + 1
+        self.next_tick_ns += due * self.period_ns
+
+        self.jitter_count += 1
+        self.jitter_sum_ns += late_ns
+        self.jitter_last_ns = late_ns
+        if late_ns > self.jitter_max_ns:
+            self.jitter_max_ns = late_ns
+
+        if due > self.max_catch_up:
+            self.skipped += due - self.max_catch_up
+            due = self.max_catch_up
+
+        self.ticks += due
+        return due
+
+    def seconds_to_next_tick(self):
+        return max(0, self.next_tick_ns - time.monotonic_ns()) / 1e9
+
+    def stats(self):
+        '''will return the tick counters and jitter in ms'''
+        mean_ns = self.jitter_sum_ns / self.jitter_count if self.jitter_count else 0
+
+        return {
+            'ticks': self.ticks,
+            'skipped': self.skipped,
+            'jitter_mean_ms': mean_ns / 1e6,
+            'jitter_max_ms': self.jitter_max_ns / 1e6,
+            'jitter_last_ms': self.jitter_last_ns / 1e6,
+        }
@@ -0,0 +1,61 @@
+from collections import deque
+from coord import Coord
+
+
+class SnakeBody:
+    '''segments of a snake, head first, in a deque
+
+        moving pushes a new head and pops the tail, growing skips the
+        next pop, so a move costs the same for any snake length
+    '''
+
+    def __init__(self, coords=()):
+        self.coords = deque(coords)
+        self.pending_growth = 0     # tail pops still to skip
+
+    def __len__(self):
+        return len(self.coords)
+
+    def __iter__(self):
+        return iter(self.coords)
+
+    def __getitem__(self, i):
+        # O(1) at both ends, O(n) in the middle
+        return self.coords[i]
+
+    def head(self):
+        return self.coords[0]
+
+    def tail(self):
+        return self.coords[-1]
+
+    def body(self):
+        '''iterates the segments after the head'''
+        it = iter(self.coords)
+        next(it, None)
+        return it
+
+    def push_head(self, coord):
+        self.coords.appendleft(coord)
+
+    def pop_tail(self):
+        return self.coords.pop()
+
+    def grow(self, segments=1):
+        self.pending_growth += segments
+
+    def next_head(self, direction):
+        dx, dy = Coord.DIRECTIONS_MOVES[Coord.DIRECTIONS.index(direction)]
+        head = self.coords[0]
+        return Coord(head.x + dx, head.y + dy)
+
+    def move(self, direction):
+        '''will return (new head, removed tail or None if the snake grew)'''
+        new_head = self.next_head(direction)
+        self.coords.appendleft(new_head)
+
+        if self.pending_growth:
+            self.pending_growth -= 1
+            return new_head, None
+
+        return new_head, self.coords.pop()
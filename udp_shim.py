@@ -0,0 +1,120 @@
+''' Lossy udp relay to try the udp snapshot channel on localhost
+
+    clients send their udp hello to the shim instead of the server
+    (Client.enable_udp(udp_addr=shim address)). every client gets its own
+    upstream socket, so the server answers through the shim, and datagrams
+    in both directions are dropped or delayed at random.
+
+    python udp_shim.py --listen 6000 --target 127.0.0.1:5555 --loss 0.1 --delay-ms 40 --jitter-ms 20
+'''
+
+import argparse
+import asyncio
+import random as rd
+
+
+class LossyLink:
+    '''drops a datagram with probability loss, delays the rest by delay +- jitter'''
+
+    def __init__(self, loss=0.0, delay_ms=0, jitter_ms=0, rng=None):
+        self.loss = loss
+        self.delay_ms = delay_ms
+        self.jitter_ms = jitter_ms
+        self.rng = rng if rng is not None else rd.Random()
+
+        self.forwarded = 0
+        self.dropped = 0
+
+    def send(self, deliver):
+        '''calls deliver() later, or never if the datagram is lost'''
+        if self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+
+        self.forwarded += 1
+        delay_ms = max(0, self.delay_ms + self.rng.uniform(-self.jitter_ms, self.jitter_ms))
+        if delay_ms == 0:
+            deliver()
+        else:
+            asyncio.get_running_loop().call_later(delay_ms / 1000, deliver)
+
+
+class _Upstream(asyncio.DatagramProtocol):
+    '''shim socket of one client, talking to the server'''
+
+    def __init__(self, shim, client_addr):
+        self.shim = shim
+        self.client_addr = client_addr
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.shim.link.send(lambda: self.shim.transport.sendto(data, self.client_addr))
+
+
+class UdpShim(asyncio.DatagramProtocol):
+
+    def __init__(self, target, link):
+        self.target = target
+        self.link = link
+        self.transport = None
+        self.upstreams = {}     # client addr -> task opening its _Upstream
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        asyncio.get_running_loop().create_task(self.forward(data, addr))
+
+    async def forward(self, data, client_addr):
+        if client_addr not in self.upstreams:
+            self.upstreams[client_addr] = asyncio.ensure_future(self.open_upstream(client_addr))
+
+        upstream = await self.upstreams[client_addr]
+        self.link.send(lambda: upstream.transport.sendto(data))
+
+    async def open_upstream(self, client_addr):
+        loop = asyncio.get_running_loop()
+        _, upstream = await loop.create_datagram_endpoint(lambda: _Upstream(self, client_addr),
+                                                          remote_addr=self.target)
+        return upstream
+
+
+async def start_shim(listen_addr, target, loss=0.0, delay_ms=0, jitter_ms=0, rng=None):
+    '''will return the running UdpShim'''
+    loop = asyncio.get_running_loop()
+    link = LossyLink(loss, delay_ms, jitter_ms, rng)
+    _, shim = await loop.create_datagram_endpoint(lambda: UdpShim(target, link), local_addr=listen_addr)
+    return shim
+
+
+def main():
+    parser = argparse.ArgumentParser(description="lossy udp relay for the snake game server")
+    parser.add_argument('--listen', type=int, default=6000, help="local udp port for the clients")
+    parser.add_argument('--target', default='127.0.0.1:5555', help="server udp host:port")
+    parser.add_argument('--loss', type=float, default=0.1)
+    parser.add_argument('--delay-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    args = parser.parse_args()
+
+    host, port = args.target.rsplit(':', 1)
+
+    async def run():
+        shim = await start_shim(('127.0.0.1', args.listen), (host, int(port)), args.loss, args.delay_ms, args.jitter_ms)
+        print(f"udp shim on 127.0.0.1:{args.listen} -> {args.target}")
+        try:
+            while True:
+                await asyncio.sleep(10)
+                print(f"forwarded {shim.link.forwarded}, dropped {shim.link.dropped}")
+        finally:
+            shim.transport.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()